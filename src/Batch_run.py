@@ -0,0 +1,244 @@
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+
+# Пакетный режим работает на сервере без дисплея
+import matplotlib
+matplotlib.use('Agg')
+
+import numpy as np
+
+from src import Test_run_body as body
+from src import detector
+from src.Job_config import default_config
+from src.Keogram_store import KeogramStore, export_keogram
+from src.Frame_index import INDEX_NAME
+from src.Wavelegth_calc import process_keogram
+
+# Файл-отметка о завершённой обработке ночи: при повторном запуске ночь пропускается
+DONE_NAME = "done.json"
+FAILED_NAME = "failed.json"
+
+# Имена результатов внутри папки ночи
+STORE_NAME = "keogram.keogram"
+KEOGRAM_NAME = "keogram.png"
+DETECT_DIR = "detections"
+WAVELENGTH_NAME = "wavelengths.npz"
+CACHE_NAME = ".keogram_cache"
+
+
+def find_nights(patterns):
+    """
+    Папки ночей по списку путей и шаблонов glob в порядке имён. Одна и та же
+    папка, заданная разными путями (например, 'data/n1' и './data/n1/'), берётся один раз.
+    """
+    nights = {}
+    for pattern in patterns:
+        matches = glob.glob(pattern) if glob.has_magic(pattern) else [pattern]
+        for match in matches:
+            night_dir = Path(match)
+            if not night_dir.is_dir():
+                continue
+            if night_dir.resolve() in nights:
+                print(f"Повтор ночи пропущен: {night_dir}")
+                continue
+            nights[night_dir.resolve()] = night_dir
+    return sorted(nights.values(), key=lambda path: (path.name, str(path)))
+
+
+def nights_root(nights):
+    """Общая папка, в которой лежат все ночи пакета"""
+    return Path(os.path.commonpath([str(Path(night_dir).resolve().parent) for night_dir in nights]))
+
+
+def night_output(night_dir, output_root, root=None):
+    """
+    Папка результатов ночи внутри output_root: путь ночи относительно общей
+    папки root (nights_root), поэтому одноимённые ночи из разных папок не
+    пишут в одну папку результатов. Без root - по имени папки ночи.
+    """
+    if root is None:
+        return Path(output_root) / Path(night_dir).name
+    return Path(output_root) / Path(night_dir).resolve().relative_to(root)
+
+
+def write_status(path, status):
+    """Атомарная запись файла состояния ночи"""
+    tmp = path.with_suffix('.tmp')
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(status, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+def process_night(night_dir, output_dir, config, export=True):
+    """
+    Полная обработка одной ночи: кеограмма в хранилище -> поиск ярких областей
+    по его полутоновой плоскости -> пиковые длины волн; PNG для просмотра -
+    отдельный шаг (export). config - общие настройки пакета, пути ночи
+    подставляются в его копию. Кэш фрагментов и индекс кадров по умолчанию
+    лежат в папке результатов, поэтому папка ночи может быть только для чтения.
+    """
+    night_dir, output_dir = Path(night_dir), Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    started = time.time()
+
+    config = config.replace(input_dir=str(night_dir), output_path=str(output_dir / KEOGRAM_NAME),
+                            keogram_store=str(output_dir / STORE_NAME),
+                            detect_output_dir=output_dir / DETECT_DIR, gray_output_dir=output_dir,
+                            cache_dir=config.cache_dir or str(output_dir / CACHE_NAME),
+                            frame_index_path=config.frame_index_path or str(output_dir / INDEX_NAME))
+
+    image_files = body.select_frames(night_dir, config.time_start, config.time_end, config)
+    if not image_files:
+        raise ValueError(f"В директории {night_dir} не найдено изображений")
+
+    combined = body.build_keogram(image_files, config=config)
+    if combined is None:
+        raise ValueError(f"Не удалось обработать ни одного кадра в {night_dir}")
+    if export:
+        export_keogram(config.keogram_store, config.output_path)
+
+    detector.detect(images=[(KEOGRAM_NAME, KeogramStore(config.keogram_store).gray)], config=config)
+
+    peaks = process_keogram(config.keogram_store, str(output_dir), config)
+    if peaks is not None:
+        np.savez(output_dir / WAVELENGTH_NAME, **peaks)
+
+    return {
+        'night': str(night_dir),
+        'frames': len(image_files),
+        'width': int(combined.shape[1]),
+        'height': int(combined.shape[0]),
+        'seconds': round(time.time() - started, 1),
+    }
+
+
+def run_night(night_dir, output_dir, config, export=True):
+    """Обработка ночи с изоляцией ошибок: результат - словарь состояния, исключения не выходят наружу"""
+    output_dir = Path(output_dir)
+    try:
+        status = process_night(night_dir, output_dir, config, export)
+    except Exception as e:
+        status = {'night': str(night_dir), 'error': f"{type(e).__name__}: {e}",
+                  'traceback': traceback.format_exc()}
+        output_dir.mkdir(parents=True, exist_ok=True)
+        write_status(output_dir / FAILED_NAME, status)
+        return False, status
+
+    write_status(output_dir / DONE_NAME, status)
+    try:
+        (output_dir / FAILED_NAME).unlink()
+    except OSError:
+        pass
+    return True, status
+
+
+def run_isolated(night_dir, output_dir, config, export=True):
+    """
+    Обработка ночи в отдельном процессе: падение процесса (нехватка памяти,
+    аварийное завершение) отмечается ошибкой только этой ночи
+    """
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        try:
+            return executor.submit(run_night, night_dir, output_dir, config, export).result()
+        except BrokenProcessPool as e:
+            status = {'night': str(night_dir), 'error': f"BrokenProcessPool: {e}"}
+            output_dir.mkdir(parents=True, exist_ok=True)
+            write_status(output_dir / FAILED_NAME, status)
+            return False, status
+
+
+def run_batch(nights, output_root, config, processes=1, force=False, export=True):
+    """
+    Обработка списка ночей, до processes ночей одновременно, каждая в своём
+    процессе. Ночи с отметкой done.json пропускаются (если не задан force),
+    ошибка или падение процесса одной ночи не останавливает остальные.
+    Возвращает список (ночь, успех, состояние).
+    """
+    report = []
+    todo = []
+    root = nights_root(nights) if nights else None
+    for night_dir in nights:
+        output_dir = night_output(night_dir, output_root, root)
+        if not force and (output_dir / DONE_NAME).exists():
+            print(f"Пропуск (уже обработана): {night_dir}")
+            report.append((night_dir, True, {'night': str(night_dir), 'skipped': True}))
+        else:
+            todo.append((night_dir, output_dir))
+
+    with ThreadPoolExecutor(max_workers=max(1, processes)) as executor:
+        futures = [(night_dir, executor.submit(run_isolated, night_dir, output_dir, config, export))
+                   for night_dir, output_dir in todo]
+        for night_dir, future in futures:
+            ok, status = future.result()
+            if ok:
+                print(f"Готово: {night_dir} ({status['frames']} кадров, {status['seconds']} с)")
+            else:
+                print(f"Ошибка: {night_dir}: {status['error']}")
+            report.append((night_dir, ok, status))
+
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Пакетная обработка ночей: кеограмма, поиск ярких областей, длины волн")
+    parser.add_argument('nights', nargs='+',
+                        help="папки ночей или шаблоны glob (например, 'data/2026-10-*')")
+    parser.add_argument('-o', '--output', required=True,
+                        help="корневая папка результатов (для каждой ночи - своя подпапка)")
+    parser.add_argument('-j', '--processes', type=int, default=1,
+                        help="число ночей, обрабатываемых одновременно")
+    parser.add_argument('--threads', type=int, default=None,
+                        help="потоков обработки кадров на ночь (по умолчанию ядра делятся между ночами)")
+    parser.add_argument('--quick-look', type=int, choices=sorted(body.REDUCED_READ_FLAGS), default=1,
+                        help="уменьшение разрешения при декодировании для быстрого просмотра")
+    parser.add_argument('--cache-dir', default=None,
+                        help="общая папка кэша фрагментов (по умолчанию в папке результатов ночи)")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="не кэшировать обработанные фрагменты")
+    parser.add_argument('--no-index', action='store_true',
+                        help="не вести индекс кадров (по умолчанию он в папке результатов ночи)")
+    parser.add_argument('--refresh-index', action='store_true',
+                        help="обойти папки ночей заново, даже если они не менялись")
+    parser.add_argument('--start', default=None, help="начало интервала времени съёмки")
+    parser.add_argument('--end', default=None, help="конец интервала времени съёмки")
+    parser.add_argument('--force', action='store_true',
+                        help="обработать заново и уже завершённые ночи")
+    parser.add_argument('--no-export', action='store_true',
+                        help="не сохранять PNG кеограммы (результат только в хранилище .keogram)")
+    args = parser.parse_args(argv)
+
+    nights = find_nights(args.nights)
+    if not nights:
+        print("Папки ночей не найдены")
+        return 2
+
+    processes = max(1, min(args.processes, len(nights)))
+    config = default_config(
+        quick_look=args.quick_look,
+        workers=args.threads or max(1, (os.cpu_count() or 1) // processes),
+        use_frame_index=not args.no_index,
+        refresh_index=args.refresh_index,
+        use_cache=not args.no_cache,
+        cache_dir=args.cache_dir,
+        time_start=args.start,
+        time_end=args.end,
+    )
+
+    print(f"Ночей: {len(nights)}, процессов: {processes}")
+    report = run_batch(nights, args.output, config, processes, args.force, not args.no_export)
+    failed = [night_dir for night_dir, ok, _ in report if not ok]
+    print(f"Обработано: {len(report) - len(failed)}, с ошибками: {len(failed)}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,274 @@
+import os
+import re
+import sqlite3
+import time
+from datetime import datetime
+from pathlib import Path
+
+import cv2
+from PIL import Image
+
+# Расширения кадров, которые попадают в индекс
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp'}
+
+# Имя файла индекса внутри папки с кадрами
+INDEX_NAME = ".frames.sqlite"
+
+# Время изменения папки моложе этого (секунды) не запоминается: файлы, добавленные
+# в тот же момент, что и обход, иначе могли бы остаться незамеченными
+DIRECTORY_MTIME_GUARD = 2.0
+
+# Дата и время съёмки в имени файла: 20261017_220015, 2026-10-17T22-00-15 и т.п.
+FILENAME_TIME = re.compile(r'(\d{4})[-_.]?(\d{2})[-_.]?(\d{2})[T_\- .]?(\d{2})[-_.:]?(\d{2})[-_.:]?(\d{2})')
+
+# Теги EXIF: DateTimeOriginal (в Exif IFD) и DateTime
+EXIF_IFD = 0x8769
+EXIF_DATETIME_ORIGINAL = 36867
+EXIF_DATETIME = 306
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS frames (
+    path TEXT PRIMARY KEY,
+    directory TEXT NOT NULL,
+    name TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    captured TEXT NOT NULL,
+    width INTEGER,
+    height INTEGER,
+    mean REAL,
+    std REAL
+);
+CREATE INDEX IF NOT EXISTS frames_captured ON frames (directory, captured);
+CREATE TABLE IF NOT EXISTS directories (
+    directory TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS quality (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    flags TEXT NOT NULL,
+    width INTEGER,
+    height INTEGER,
+    mean REAL,
+    std REAL,
+    saturated REAL,
+    dhash TEXT,
+    sha1 TEXT
+);
+"""
+
+# Столбцы оценки качества кадра (Frame_quality.screen_frame), хранимые в индексе
+QUALITY_FIELDS = ('status', 'flags', 'width', 'height', 'mean', 'std', 'saturated', 'dhash', 'sha1')
+
+
+def parse_capture_time(img_path, img=None):
+    """Время съёмки из имени файла, затем из EXIF, иначе время изменения файла"""
+    match = FILENAME_TIME.search(Path(img_path).stem)
+    if match:
+        try:
+            return datetime(*map(int, match.groups()))
+        except ValueError:
+            pass
+
+    if img is not None:
+        exif = img.getexif()
+        value = exif.get_ifd(EXIF_IFD).get(EXIF_DATETIME_ORIGINAL) or exif.get(EXIF_DATETIME)
+        if value:
+            try:
+                return datetime.strptime(str(value).strip(), "%Y:%m:%d %H:%M:%S")
+            except ValueError:
+                pass
+
+    return datetime.fromtimestamp(os.stat(img_path).st_mtime)
+
+
+def frame_record(img_path, stat):
+    """Строка индекса: размеры и время по заголовку, статистика по уменьшенному декодированию"""
+    width = height = None
+    captured = None
+    try:
+        with Image.open(img_path) as img:
+            width, height = img.size
+            captured = parse_capture_time(img_path, img)
+    except OSError:
+        pass
+    if captured is None:
+        captured = parse_capture_time(img_path)
+
+    # Декодирование JPEG в 1/8 разрешения почти ничего не стоит
+    mean = std = None
+    small = cv2.imread(str(img_path), cv2.IMREAD_REDUCED_GRAYSCALE_8)
+    if small is not None:
+        mean_value, std_value = cv2.meanStdDev(small)
+        mean, std = float(mean_value[0, 0]), float(std_value[0, 0])
+
+    return (str(img_path), str(Path(img_path).parent), Path(img_path).name,
+            stat.st_size, stat.st_mtime_ns, captured.isoformat(sep=' '),
+            width, height, mean, std)
+
+
+class FrameIndex:
+    """
+    Постоянный индекс кадров в SQLite: путь, размер, время изменения, время съёмки,
+    размеры и простая статистика яркости. Обновляется инкрементально - заново
+    читаются только новые и изменённые файлы; выборка по времени съёмки
+    идёт по индексу, без обхода папки. Папка обходится, только если с прошлого
+    обхода изменилось время её изменения (добавлены, удалены или переименованы
+    файлы) или обход запрошен явно (force).
+    """
+
+    def __init__(self, db_path):
+        self.db_path = Path(db_path)
+        self.connection = sqlite3.connect(str(self.db_path))
+        # Журнал не удаляется после записи: индекс внутри папки кадров не меняет время её изменения
+        self.connection.execute("PRAGMA journal_mode=PERSIST")
+        self.connection.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def update(self, directory, force=True):
+        """
+        Добавление новых и изменённых кадров папки, удаление исчезнувших.
+        При force=False папка не обходится, если время её изменения то же,
+        что при прошлом обходе (файлы, перезаписанные на месте, так не видны).
+        """
+        directory = str(Path(directory))
+        mtime_ns = os.stat(directory).st_mtime_ns
+        if not force:
+            row = self.connection.execute(
+                "SELECT mtime_ns FROM directories WHERE directory = ?", (directory,)).fetchone()
+            if row is not None and row[0] == mtime_ns:
+                return 0
+
+        known = {path: (size, mtime_ns) for path, size, mtime_ns in self.connection.execute(
+            "SELECT path, size, mtime_ns FROM frames WHERE directory = ?", (directory,))}
+
+        changed, present = [], set()
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if not entry.is_file() or Path(entry.name).suffix.lower() not in IMAGE_EXTENSIONS:
+                    continue
+                path = str(Path(directory) / entry.name)
+                present.add(path)
+                stat = entry.stat()
+                if known.get(path) != (stat.st_size, stat.st_mtime_ns):
+                    changed.append(frame_record(path, stat))
+
+        removed = [(path,) for path in known.keys() - present]
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO frames VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", changed)
+            self.connection.executemany("DELETE FROM frames WHERE path = ?", removed)
+            # Время изменения читается до обхода: изменения во время обхода вызовут следующий
+            if time.time() - mtime_ns / 1e9 < DIRECTORY_MTIME_GUARD:
+                mtime_ns = -1
+            self.connection.execute("INSERT OR REPLACE INTO directories VALUES (?, ?)", (directory, mtime_ns))
+        return len(changed)
+
+    def frames(self, directory, start=None, end=None):
+        """Кадры папки в порядке времени съёмки, при необходимости в интервале [start, end]"""
+        query = "SELECT path FROM frames WHERE directory = ?"
+        params = [str(Path(directory))]
+        if start is not None:
+            query += " AND captured >= ?"
+            params.append(_time_key(start))
+        if end is not None:
+            query += " AND captured <= ?"
+            params.append(_time_key(end))
+        query += " ORDER BY captured, name"
+        return [Path(path) for path, in self.connection.execute(query, params)]
+
+    def quality(self, directory):
+        """Сохранённые оценки качества кадров папки, действительные для текущих размера и времени изменения"""
+        rows = self.connection.execute(
+            f"SELECT q.path, {', '.join('q.' + key for key in QUALITY_FIELDS)} FROM quality q "
+            "JOIN frames f ON q.path = f.path AND q.size = f.size AND q.mtime_ns = f.mtime_ns "
+            "WHERE f.directory = ?", (str(Path(directory)),))
+        result = {}
+        for path, *values in rows:
+            row = dict(zip(QUALITY_FIELDS, values), path=Path(path), name=Path(path).name)
+            row['dhash'] = int(row['dhash'])
+            result[Path(path)] = row
+        return result
+
+    def store_quality(self, rows):
+        """Сохранение оценок качества кадров, которые есть в индексе (с их размером и временем изменения)"""
+        with self.connection:
+            self.connection.executemany(
+                f"INSERT OR REPLACE INTO quality SELECT path, size, mtime_ns, "
+                f"{', '.join('?' * len(QUALITY_FIELDS))} FROM frames WHERE path = ?",
+                [tuple(str(row['dhash']) if key == 'dhash' else row[key] for key in QUALITY_FIELDS)
+                 + (str(row['path']),) for row in rows])
+
+
+def _time_key(value):
+    """Время в формате, в котором оно хранится в индексе"""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return value.isoformat(sep=' ')
+
+
+def indexed_frames(directory, start=None, end=None, db_path=None, refresh=False):
+    """
+    Обновление индекса папки (обход - только если папка изменилась или refresh)
+    и выборка кадров по времени съёмки
+    """
+    with FrameIndex(db_path or Path(directory) / INDEX_NAME) as index:
+        index.update(directory, force=refresh)
+        return index.frames(directory, start, end)
+
+
+def indexed_quality(paths, db_path=None):
+    """Сохранённые в индексе оценки качества кадров (словарь путь - строка отчёта)"""
+    known = {}
+    for directory in {Path(path).parent for path in paths}:
+        index_path = Path(db_path or directory / INDEX_NAME)
+        if index_path.exists():
+            with FrameIndex(index_path) as index:
+                known.update(index.quality(directory))
+    return known
+
+
+def store_quality(rows, db_path=None):
+    """Запись оценок качества кадров в индексы их папок"""
+    by_directory = {}
+    for row in rows:
+        by_directory.setdefault(Path(row['path']).parent, []).append(row)
+    for directory, dir_rows in by_directory.items():
+        index_path = Path(db_path or directory / INDEX_NAME)
+        if index_path.exists():
+            with FrameIndex(index_path) as index:
+                index.store_quality(dir_rows)
+
+
+def capture_times(paths, db_path=None):
+    """
+    Время съёмки кадров: из индекса папки, если он есть, иначе по имени файла
+    или времени изменения. Возвращает словарь путь - время в формате индекса.
+    """
+    times = {}
+    by_directory = {}
+    for path in map(Path, paths):
+        by_directory.setdefault(path.parent, []).append(path)
+
+    for directory, dir_paths in by_directory.items():
+        index_path = Path(db_path or directory / INDEX_NAME)
+        if index_path.exists():
+            with FrameIndex(index_path) as index:
+                known = dict(index.connection.execute(
+                    "SELECT path, captured FROM frames WHERE directory = ?", (str(directory),)))
+        else:
+            known = {}
+        for path in dir_paths:
+            times[path] = known.get(str(path)) or _time_key(parse_capture_time(path))
+    return times
@@ -0,0 +1,105 @@
+import csv
+import hashlib
+import io
+
+import cv2
+import numpy as np
+from PIL import Image
+
+# Пороги отбраковки кадров
+BLACK_MEAN = 2.0  # Средняя яркость ниже - кадр считается чёрным
+SATURATED_LEVEL = 250  # Яркость пересвеченного пикселя
+SATURATED_FRACTION = 0.5  # Доля пересвеченных пикселей, при которой кадр отбрасывается
+MIN_STD = 1.5  # Меньший разброс яркости - однородный кадр (облачность), только отметка
+SIMILAR_DISTANCE = 2  # Расстояние Хэмминга dHash до предыдущего кадра для отметки "похож"
+HASH_SAMPLE_BYTES = 64 * 1024  # Байт начала и конца файла в хэше для поиска повторов
+
+REPORT_COLUMNS = ('name', 'status', 'flags', 'width', 'height', 'mean', 'std',
+                  'saturated', 'dhash', 'sha1')
+
+
+def difference_hash(gray):
+    """Перцептивный dHash: 64 бита сравнения соседних пикселей уменьшенного кадра"""
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).ravel()
+    return int(np.packbits(bits).view('>u8')[0])
+
+
+def content_hash(data):
+    """
+    SHA-1 размера файла, его первых и последних HASH_SAMPLE_BYTES байт.
+    Копии кадра совпадают целиком, а у разных кадров JPEG сжатые данные
+    различаются уже в начале файла, поэтому весь файл не хэшируется.
+    """
+    digest = hashlib.sha1(str(data.size).encode('ascii'))
+    if data.size <= 2 * HASH_SAMPLE_BYTES:
+        digest.update(data)
+    else:
+        digest.update(data[:HASH_SAMPLE_BYTES])
+        digest.update(data[-HASH_SAMPLE_BYTES:])
+    return digest.hexdigest()
+
+
+def screen_frame(img_path):
+    """
+    Быстрая оценка кадра по уменьшенному декодированию: яркость, разброс,
+    доля пересвеченных пикселей, dHash и хэш содержимого файла (content_hash).
+    Файл, который не удалось прочитать, получает статус 'unreadable'.
+    """
+    row = {'path': img_path, 'name': img_path.name, 'sha1': '',
+           'status': 'unreadable', 'flags': '', 'width': 0, 'height': 0,
+           'mean': 0.0, 'std': 0.0, 'saturated': 0.0, 'dhash': 0}
+    try:
+        data = np.fromfile(str(img_path), dtype=np.uint8)
+    except OSError:
+        return row
+    row['sha1'] = content_hash(data)
+
+    # DCT-масштабирование JPEG: декодируется 1/64 пикселей
+    small = cv2.imdecode(data, cv2.IMREAD_REDUCED_GRAYSCALE_8)
+    if small is None:
+        return row
+    try:
+        with Image.open(io.BytesIO(data.tobytes())) as img:
+            row['width'], row['height'] = img.size
+    except OSError:
+        row['height'], row['width'] = (dim * 8 for dim in small.shape[:2])
+
+    mean, std = cv2.meanStdDev(small)
+    row['mean'], row['std'] = float(mean[0, 0]), float(std[0, 0])
+    row['saturated'] = float(np.count_nonzero(small >= SATURATED_LEVEL)) / small.size
+    row['dhash'] = difference_hash(small)
+
+    if row['mean'] < BLACK_MEAN:
+        row['status'] = 'black'
+    elif row['saturated'] >= SATURATED_FRACTION:
+        row['status'] = 'saturated'
+    else:
+        row['status'] = 'ok'
+        if row['std'] < MIN_STD:
+            row['flags'] = 'flat'
+    return row
+
+
+def mark_duplicates(rows):
+    """Отметка повторов в порядке кадров: одинаковые файлы отбрасываются, похожие отмечаются"""
+    seen = set()
+    previous_hash = None
+    for row in rows:
+        if row['status'] == 'ok' and row['sha1'] in seen:
+            row['status'] = 'duplicate'
+        elif (row['status'] == 'ok' and previous_hash is not None
+              and bin(row['dhash'] ^ previous_hash).count('1') <= SIMILAR_DISTANCE):
+            row['flags'] = ';'.join(filter(None, [row['flags'], 'similar']))
+        seen.add(row['sha1'])
+        if row['status'] != 'unreadable':
+            previous_hash = row['dhash']
+    return rows
+
+
+def write_report(rows, report_path):
+    """Отчёт о качестве кадров в CSV"""
+    with open(report_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(REPORT_COLUMNS)
+        writer.writerows([row[key] for key in REPORT_COLUMNS] for row in rows)
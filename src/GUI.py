@@ -1,14 +1,22 @@
+import os
 import cv2
-import numpy as np
 from pathlib import Path
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 import threading
 from PIL import Image, ImageTk
 
-from src.Grey_fade import grey_scale
+from src.Grey_fade import convert_to_grayscale
 from src.Wavelegth_calc import graphscalc
 from src.detector import detect
+from functools import partial
+
+from src.Test_run_body import filter_center_crop, filter_halo, process_images_parallel, KeogramWriter
+from src.Test_run_body import read_frame_bytes, REDUCED_READ_FLAGS
+from src import Test_run_body as body
+from src.Job_config import default_config
+from src.Frame_index import indexed_frames
+from src.Strip_cache import StripCache, RegionCache
 
 # ========== ГЛОБАЛЬНЫЕ НАСТРОЙКИ ==========
 INPUT_DIR = "E:\CMU\Code\Sky_samples"
@@ -19,6 +27,21 @@ BILATERAL_SIGMA_COLOR = 10
 BILATERAL_SIGMA_SPACE = 10
 CROP_WIDTH = 30
 CROP_HEIGHT = 2000
+CROP_FIRST = True
+WORKERS = os.cpu_count() or 1
+USE_CACHE = True
+CACHE_DIR = None  # None - папка .keogram_cache внутри INPUT_DIR
+QUICK_LOOK = 1  # Уменьшение разрешения при декодировании (1, 2, 4, 8)
+USE_FRAME_INDEX = True
+TIME_START = None
+TIME_END = None
+
+# Центральная область кадров, которая держится в памяти между запусками:
+# при подборе параметров в этих пределах кадры не декодируются заново
+REGION_MAX_CROP_WIDTH = 128
+REGION_MAX_CROP_HEIGHT = 4000
+REGION_MAX_HALO = 32
+REGION_SPILL_DIR = None  # Папка для областей на диске (None - только в памяти)
 
 
 # ==========================================
@@ -29,6 +52,8 @@ class ImageProcessorApp(tk.Tk):
         self.title("Обработчик изображений неба")
         self.geometry("700x700")
         self.progress_lock = threading.Lock()
+        self.region_cache = RegionCache(REGION_MAX_CROP_WIDTH, REGION_MAX_CROP_HEIGHT, REGION_MAX_HALO,
+                                        spill_dir=REGION_SPILL_DIR)
         self.create_widgets()
 
     def create_widgets(self):
@@ -49,6 +74,17 @@ class ImageProcessorApp(tk.Tk):
                                                                               padx=5)
         ttk.Button(output_frame, text="Обзор", command=self.select_output_file).pack(side='left')
 
+        # Интервал времени съёмки (пусто - все кадры)
+        time_frame = ttk.Frame(self)
+        time_frame.pack(fill='x', padx=10, pady=5)
+        ttk.Label(time_frame, text="Время съёмки с:").pack(side='left')
+        self.time_start = tk.StringVar(value=TIME_START or "")
+        ttk.Entry(time_frame, textvariable=self.time_start, width=18).pack(side='left', padx=5)
+        ttk.Label(time_frame, text="по:").pack(side='left')
+        self.time_end = tk.StringVar(value=TIME_END or "")
+        ttk.Entry(time_frame, textvariable=self.time_end, width=18).pack(side='left', padx=5)
+        ttk.Label(time_frame, text="(ГГГГ-ММ-ДД ЧЧ:ММ)").pack(side='left')
+
         # Параметры обработки
         params_frame = ttk.LabelFrame(self, text="Параметры обработки")
         params_frame.pack(fill='both', expand=True, padx=10, pady=5)
@@ -65,6 +101,10 @@ class ImageProcessorApp(tk.Tk):
                                   'crop_width', CROP_WIDTH, 4)
         self.create_parameter_row(params_frame, "Высота области обрезки (Y):",
                                   'crop_height', CROP_HEIGHT, 5)
+        self.create_parameter_row(params_frame, "Число потоков обработки:",
+                                  'workers', WORKERS, 6)
+        self.create_parameter_row(params_frame, "Быстрый просмотр (1, 2, 4, 8):",
+                                  'quick_look', QUICK_LOOK, 7)
 
         # Прогресс-бар
         self.progress = ttk.Progressbar(self, orient='horizontal', mode='determinate')
@@ -103,17 +143,25 @@ class ImageProcessorApp(tk.Tk):
             params = {
                 'input_dir': self.input_dir.get(),
                 'output_path': self.output_path.get(),
-                'median_blur': self.median_blur.get(),
+                'median_blur_size': self.median_blur.get(),
                 'bilateral_d': self.bilateral_d.get(),
-                'sigma_color': self.sigma_color.get(),
-                'sigma_space': self.sigma_space.get(),
+                'bilateral_sigma_color': self.sigma_color.get(),
+                'bilateral_sigma_space': self.sigma_space.get(),
                 'crop_width': self.crop_width.get(),
-                'crop_height': self.crop_height.get()
+                'crop_height': self.crop_height.get(),
+                'workers': self.workers.get(),
+                'quick_look': self.quick_look.get(),
+                'time_start': self.time_start.get().strip() or None,
+                'time_end': self.time_end.get().strip() or None
             }
         except tk.TclError as e:
             messagebox.showerror("Ошибка ввода", f"Некорректные параметры: {str(e)}")
             return
 
+        if params['quick_look'] not in REDUCED_READ_FLAGS:
+            messagebox.showerror("Ошибка ввода", "Быстрый просмотр: допустимы значения 1, 2, 4, 8")
+            return
+
         self.process_btn.config(state='disabled')
         self.preview_btn.config(state='disabled')
         self.progress['value'] = 0
@@ -127,19 +175,17 @@ class ImageProcessorApp(tk.Tk):
 
     def run_processing(self, **kwargs):
         try:
-            global INPUT_DIR, OUTPUT_PATH, MEDIAN_BLUR_SIZE, BILATERAL_D
-            global BILATERAL_SIGMA_COLOR, BILATERAL_SIGMA_SPACE, CROP_WIDTH, CROP_HEIGHT
-
-            # Обновляем глобальные переменные
-            for key, value in kwargs.items():
-                globals()[key.upper()] = value
+            # Настройки задания из формы; глобальные переменные модуля не меняются
+            config = gui_config(**kwargs)
 
             # Обработка изображений
-            self.process_images_with_progress()
+            combined = self.process_images_with_progress(config)
+            if combined is None:
+                return
 
-            # Дополнительные этапы обработки
-            grey_scale()
-            detect()
+            # Дополнительные этапы обработки в памяти, без повторного чтения JPEG
+            gray = convert_to_grayscale(combined)
+            detect(images=[(Path(config.output_path).name, gray)], config=config)
 
 
             self.after(0, lambda: messagebox.showinfo("Готово", "Обработка успешно завершена!"))
@@ -150,32 +196,75 @@ class ImageProcessorApp(tk.Tk):
         finally:
             self.after(0, lambda: self.process_btn.config(state='normal'))
 
-    def process_images_with_progress(self):
+    def process_images_with_progress(self, config=None):
         """Основной процесс обработки с обновлением прогресса"""
         try:
-            image_files = get_image_files(INPUT_DIR)
+            config = config or gui_config()
+            if config.use_frame_index:
+                image_files = indexed_frames(config.input_dir, config.time_start, config.time_end,
+                                             config.frame_index_path, config.refresh_index)
+            else:
+                image_files = get_image_files(config.input_dir)
             if not image_files:
-                raise ValueError(f"В директории {INPUT_DIR} не найдено изображений")
+                raise ValueError(f"В директории {config.input_dir} не найдено изображений")
 
             total_images = len(image_files)
             self.after(0, lambda: self.progress.configure(maximum=total_images))
 
-            processed_images = []
-            for i, img_path in enumerate(image_files, 1):
-                cropped = process_image(img_path)
+            # Декодированные области кадров переиспользуются при смене параметров
+            process = partial(process_image, config=config)
+            read = read_frame_bytes
+            halo = filter_halo(config.median_blur_size, config.bilateral_d, config.bilateral_sigma_space)
+            if config.quick_look == 1 and self.region_cache.covers(config.crop_width, config.crop_height, halo):
+                self.region_cache.retain(image_files)
+                process = partial(self.process_cached_region, config=config)
+                read = self.read_uncached_region
+
+            # Кадры, уже обработанные с теми же параметрами, берутся из кэша
+            params = filter_params(config)
+            if config.use_cache:
+                cache = StripCache(config.cache_dir or Path(config.input_dir) / ".keogram_cache")
+                process = cache.cached(process, params + (config.quick_look,))
+                read = cache.cached_read(read, params + (config.quick_look,))
+
+            # Чтение файлов идёт в отдельных потоках с опережением декодирования
+            writer = KeogramWriter(total_images, params[4])
+            frames = process_images_parallel(image_files, process, config.workers, read, config)
+            for i, (img_path, cropped) in enumerate(frames, 1):
                 if cropped is not None:
-                    processed_images.append(cropped)
+                    writer.append(cropped)
                     print(f"Обработано: {img_path.name}")
                 self.after(0, self.update_progress, i)
 
-            if processed_images:
-                combined = combine_images(processed_images)
-                if combined is not None:
-                    cv2.imwrite(OUTPUT_PATH, combined)
-                    print(f"Результат сохранён в: {OUTPUT_PATH}")
+            combined = writer.result()
+            if combined is not None:
+                cv2.imwrite(str(config.output_path), combined)
+                print(f"Результат сохранён в: {config.output_path}")
+            return combined
+
+        except Exception as e:
+            self.after(0, lambda err=str(e): messagebox.showerror("Ошибка обработки", err))
+            return None
+
+    def read_uncached_region(self, img_path):
+        """Чтение файла кадра, если его область ещё не в кэше"""
+        if img_path in self.region_cache:
+            return None
+        return read_frame_bytes(img_path)
+
+    def process_cached_region(self, img_path, data=None, config=None):
+        """Фильтрация фрагмента по декодированной области кадра из кэша"""
+        try:
+            region = self.region_cache.get(img_path, data)
+            if region is None:
+                print(f"Ошибка загрузки: {img_path.name}")
+                return None
 
+            pixels, origin, full_shape = region
+            return filter_center_crop(pixels, *filter_params(config), origin, full_shape)
         except Exception as e:
-            self.after(0, lambda: messagebox.showerror("Ошибка обработки", str(e)))
+            print(f"Ошибка обработки {img_path.name}: {str(e)}")
+            return None
 
     def show_preview(self):
         """Окно предпросмотра результатов"""
@@ -183,7 +272,7 @@ class ImageProcessorApp(tk.Tk):
             preview_window = tk.Toplevel(self)
             preview_window.title("Полученное изображение")
 
-            img = Image.open(OUTPUT_PATH)
+            img = Image.open(self.output_path.get())
 
             # Масштабирование изображения
             max_size = (800, 600)
@@ -209,44 +298,42 @@ def get_image_files(directory):
             if f.is_file() and f.suffix.lower() in image_extensions]
 
 
-def reduce_jpeg_artifacts(img):
-    filtered = cv2.medianBlur(img, MEDIAN_BLUR_SIZE)
-    return cv2.bilateralFilter(filtered,
-                               d=BILATERAL_D,
-                               sigmaColor=BILATERAL_SIGMA_COLOR,
-                               sigmaSpace=BILATERAL_SIGMA_SPACE)
+def gui_config(**changes):
+    """Настройки задания: значения по умолчанию окна с заменой полей из changes"""
+    values = dict(input_dir=INPUT_DIR, output_path=OUTPUT_PATH, median_blur_size=MEDIAN_BLUR_SIZE,
+                  bilateral_d=BILATERAL_D, bilateral_sigma_color=BILATERAL_SIGMA_COLOR,
+                  bilateral_sigma_space=BILATERAL_SIGMA_SPACE, crop_width=CROP_WIDTH,
+                  crop_height=CROP_HEIGHT, crop_first=CROP_FIRST, workers=WORKERS,
+                  use_cache=USE_CACHE, cache_dir=CACHE_DIR, quick_look=QUICK_LOOK,
+                  use_frame_index=USE_FRAME_INDEX, time_start=TIME_START, time_end=TIME_END)
+    values.update(changes)
+    return default_config(**values)
 
 
-def extract_center_crop(img):
-    h, w = img.shape[:2]
-    y_start = max(0, (h - CROP_HEIGHT) // 2)
-    x_start = max(0, (w - CROP_WIDTH) // 2)
-    return img[y_start:y_start + CROP_HEIGHT,
-           x_start:x_start + CROP_WIDTH]
+def reduce_jpeg_artifacts(img, config=None):
+    return body.reduce_jpeg_artifacts(img, config or gui_config())
 
 
-def process_image(img_path):
-    try:
-        img = cv2.imread(str(img_path))
-        if img is None:
-            print(f"Ошибка загрузки: {img_path.name}")
-            return None
+def extract_center_crop(img, config=None):
+    return body.extract_center_crop(img, config or gui_config())
 
-        processed = reduce_jpeg_artifacts(img)
-        cropped = extract_center_crop(processed)
-        return cropped
-    except Exception as e:
-        print(f"Ошибка обработки {img_path.name}: {str(e)}")
-        return None
+
+def filter_params(config=None):
+    return body.filter_params(config or gui_config())
+
+
+def process_image(img_path, data=None, config=None):
+    return body.process_image(img_path, data, config or gui_config())
 
 
 def combine_images(images):
     if not images:
         return None
 
-    min_height = min(img.shape[0] for img in images)
-    cropped = [img[:min_height] for img in images]
-    return np.hstack(cropped)
+    writer = KeogramWriter(len(images), max(img.shape[1] for img in images))
+    for img in images:
+        writer.append(img)
+    return writer.result()
 
 
 if __name__ == "__main__":
@@ -2,22 +2,38 @@ import cv2
 import numpy as np
 from pathlib import Path
 
+# Default folders
+INPUT_DIR = Path("E:\CMU\Code\Samples_res")  # Folder containing color images
+OUTPUT_DIR = Path("E:\CMU\Code\Greyscale\Grayscale_Output")  # Folder for grayscale results
 
-def convert_to_grayscale(color_img):
+
+def convert_to_grayscale(color_img, out=None):
     """
     Convert color image to grayscale while preserving perceived brightness.
-    Uses the standard luminance formula: Y = 0.299*R + 0.587*G + 0.114*B
+    Uses the standard luminance formula: Y = 0.299*R + 0.587*G + 0.114*B,
+    evaluated by OpenCV in fixed-point integer arithmetic (no float temporaries,
+    result within +-1 of the float formula).
+
+    Accepts a single BGR/BGRA image (H, W, C) or a batch of frames (N, H, W, C).
+    `out` is an optional preallocated uint8 buffer of the result shape.
     """
     if len(color_img.shape) == 2:  # Already grayscale
-        return color_img.copy()
+        if out is None:
+            return color_img.copy()
+        np.copyto(out, color_img)
+        return out
 
-    # Convert BGR to RGB (OpenCV uses BGR by default)
-    rgb_img = cv2.cvtColor(color_img, cv2.COLOR_BGR2RGB)
+    channels = color_img.shape[-1]
+    code = cv2.COLOR_BGRA2GRAY if channels == 4 else cv2.COLOR_BGR2GRAY
 
-    # Calculate luminance using the standard formula
-    grayscale = np.dot(rgb_img[..., :3], [0.299, 0.587, 0.114]).astype(np.uint8)
+    if color_img.ndim == 4:
+        # A batch is converted as one tall image of stacked frames
+        n, h, w = color_img.shape[:3]
+        frames = np.ascontiguousarray(color_img).reshape(n * h, w, channels)
+        dst = None if out is None else out.reshape(n * h, w)
+        return cv2.cvtColor(frames, code, dst=dst).reshape(n, h, w)
 
-    return grayscale
+    return cv2.cvtColor(color_img, code, dst=out)
 
 
 def process_images(input_dir, output_dir):
@@ -52,8 +68,8 @@ def process_images(input_dir, output_dir):
 
 def grey_scale():
     # Set paths
-    input_dir = Path("E:\CMU\Code\Samples_res")  # Folder containing color images
-    output_dir = Path("E:\CMU\Code\Greyscale\Grayscale_Output")  # Folder for grayscale results
+    input_dir = INPUT_DIR
+    output_dir = OUTPUT_DIR
 
     print(f"Converting images from: {input_dir}")
     print(f"Saving grayscale images to: {output_dir}")
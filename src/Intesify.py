@@ -1,28 +1,43 @@
+import math
 import tkinter as tk
+from collections import OrderedDict
 from tkinter import filedialog
 from PIL import Image, ImageTk
-import numpy as np
+
+from src.Keogram_pyramid import KeogramPyramid
 
 
 class PixelIntensityApp:
     MAX_DISPLAY_WIDTH = 800
     MAX_DISPLAY_HEIGHT = 600
+    ZOOM_STEP = 1.25  # Изменение масштаба за один шаг колеса мыши
+    MAX_ZOOM = 16.0  # Наибольшее увеличение (пикселей экрана на пиксель изображения)
+    PHOTO_CACHE_PIXELS = 16 * 2 ** 20  # Сумма пикселей отрисованных тайлов, которые держатся в памяти
+    PROFILE_SIZE = 120  # Высота профиля строки и ширина профиля столбца
+    ROI_DEFAULT = 21  # Размер области статистики вокруг маркера по умолчанию
+    INTEGRALS_POLL_MS = 200  # Период проверки фонового построения таблиц сумм
 
     def __init__(self, root):
         self.root = root
         self.root.title("Анализатор пикселей")
 
         # Переменные для данных изображения
-        self.pixels = None
-        self.photo_image = None
+        self.pyramid = None
+        self.pixels = None  # np.memmap полного разрешения из пирамиды
         self.image_size = (0, 0)
-        self.scale_factor = 1.0
+        self.scale_factor = 1.0  # Пикселей экрана на пиксель изображения
+        self.view_x = 0.0  # Координаты изображения в левом верхнем углу Canvas
+        self.view_y = 0.0
+        self.photo_cache = OrderedDict()
+        self.photo_cache_pixels = 0
+        self.drag_start = None
         self.canvas = None
         self.marker = None
 
         # Настройка сетки окна
         self.root.columnconfigure(0, weight=1)
         self.root.columnconfigure(1, weight=0)
+        self.root.columnconfigure(2, weight=0)
         self.root.rowconfigure(1, weight=1)
 
         # Создание элементов GUI
@@ -31,12 +46,20 @@ class PixelIntensityApp:
     def create_widgets(self):
         # Кнопка загрузки изображения
         self.load_btn = tk.Button(self.root, text="Загрузить изображение", command=self.load_image)
-        self.load_btn.grid(row=0, column=0, columnspan=2, padx=5, pady=5, sticky='ew')
+        self.load_btn.grid(row=0, column=0, columnspan=3, padx=5, pady=5, sticky='ew')
 
         # Canvas для отображения изображения и маркера
         self.canvas = tk.Canvas(self.root, width=self.MAX_DISPLAY_WIDTH, height=self.MAX_DISPLAY_HEIGHT)
         self.canvas.grid(row=1, column=0, padx=5, pady=5, sticky='nsew')
 
+        # Перемещение перетаскиванием, масштаб колесом мыши относительно курсора
+        self.canvas.bind('<ButtonPress-1>', self.start_pan)
+        self.canvas.bind('<B1-Motion>', self.pan)
+        self.canvas.bind('<MouseWheel>', lambda e: self.zoom_at(e.x, e.y, 1 if e.delta > 0 else -1))
+        self.canvas.bind('<Button-4>', lambda e: self.zoom_at(e.x, e.y, 1))
+        self.canvas.bind('<Button-5>', lambda e: self.zoom_at(e.x, e.y, -1))
+        self.canvas.bind('<Configure>', lambda e: self.render())
+
         # Вертикальный слайдер справа
         self.y_slider = tk.Scale(self.root, from_=0, to=0, orient='vertical',
                                  resolution=1, command=self.update_intensity)
@@ -47,56 +70,58 @@ class PixelIntensityApp:
                                  resolution=1, command=self.update_intensity)
         self.x_slider.grid(row=2, column=0, padx=5, pady=5, sticky='ew')
 
+        # Профиль столбца справа от изображения, профиль строки под ним
+        self.column_profile = tk.Canvas(self.root, width=self.PROFILE_SIZE, height=self.MAX_DISPLAY_HEIGHT,
+                                        bg='white')
+        self.column_profile.grid(row=1, column=2, padx=5, pady=5, sticky='ns')
+        self.row_profile = tk.Canvas(self.root, width=self.MAX_DISPLAY_WIDTH, height=self.PROFILE_SIZE,
+                                     bg='white')
+        self.row_profile.grid(row=3, column=0, padx=5, pady=5, sticky='ew')
+
         # Метка для отображения интенсивности
         self.intensity_label = tk.Label(self.root, text="Интенсивность: ")
-        self.intensity_label.grid(row=3, column=0, columnspan=2, padx=5, pady=5, sticky='ew')
+        self.intensity_label.grid(row=4, column=0, columnspan=3, padx=5, pady=5, sticky='ew')
+
+        # Размер области вокруг маркера и её статистика
+        roi_frame = tk.Frame(self.root)
+        roi_frame.grid(row=5, column=0, columnspan=3, padx=5, pady=5, sticky='ew')
+        tk.Label(roi_frame, text="Область (Ш x В):").pack(side='left')
+        self.roi_width = tk.IntVar(value=self.ROI_DEFAULT)
+        self.roi_height = tk.IntVar(value=self.ROI_DEFAULT)
+        for var in (self.roi_width, self.roi_height):
+            tk.Spinbox(roi_frame, from_=1, to=100000, width=7, textvariable=var,
+                       command=self.update_intensity).pack(side='left', padx=2)
+            var.trace_add('write', lambda *args: self.update_intensity())
+        self.roi_label = tk.Label(roi_frame, text="")
+        self.roi_label.pack(side='left', padx=10)
 
     def load_image(self):
-        file_path = filedialog.askopenfilename()
+        # Хранилище кеограммы (.keogram) открывается выбором его файла header.json
+        file_path = filedialog.askopenfilename(filetypes=[
+            ("Изображения и хранилища кеограмм", "*.png *.jpg *.jpeg *.bmp *.tif *.tiff *.npy header.json"),
+            ("Все файлы", "*.*")])
         if not file_path:
             return
 
         try:
-            img = Image.open(file_path).convert('L')
-            self.image_size = img.size
+            # Пирамида строится один раз и берётся из кэша на диске при следующих открытиях
+            self.pyramid = KeogramPyramid(file_path)
+            self.pixels = self.pyramid.levels[0]
+            self.image_size = (self.pyramid.width, self.pyramid.height)
 
             # Очистка предыдущего изображения и маркера
             self.canvas.delete("all")
+            self.photo_cache.clear()
+            self.photo_cache_pixels = 0
             self.marker = None
 
-            self.pixels = np.array(img)
-            img_rgb = img.convert('RGB')
-            img_display = self.resize_image(img_rgb)
-
-            # Центрирование изображения на Canvas
-            self.photo_image = ImageTk.PhotoImage(img_display)
-            img_width = img_display.width
-            img_height = img_display.height
-
-            # Координаты для центрирования изображения
-            x_offset = (self.MAX_DISPLAY_WIDTH - img_width) // 2
-            y_offset = (self.MAX_DISPLAY_HEIGHT - img_height) // 2
-
-            self.canvas.create_image(
-                x_offset, y_offset,
-                anchor='nw', image=self.photo_image,
-                tags="image"
-            )
+            # Начальный масштаб - изображение целиком помещается в окно (без увеличения)
+            self.scale_factor = min(1.0, self.MAX_DISPLAY_WIDTH / self.image_size[0],
+                                    self.MAX_DISPLAY_HEIGHT / self.image_size[1])
+            self.view_x = self.view_y = 0.0
 
             # Создание маркера
-            self.marker = self.canvas.create_oval(
-                x_offset - 3, y_offset - 3,
-                x_offset + 3, y_offset + 3,
-                fill='red', state='hidden'
-            )
-
-            # Сохранение параметров отображения
-            self.display_params = {
-                'x_offset': x_offset,
-                'y_offset': y_offset,
-                'img_width': img_width,
-                'img_height': img_height
-            }
+            self.marker = self.canvas.create_oval(-3, -3, 3, 3, fill='red', state='hidden')
 
             # Настройка слайдеров
             self.x_slider.config(to=self.image_size[0] - 1)
@@ -104,25 +129,143 @@ class PixelIntensityApp:
             self.x_slider.set(0)
             self.y_slider.set(0)
 
+            # Таблицы сумм для статистики области и профилей строятся в фоне
+            self.pyramid.build_integrals_async()
+            self.render()
             if self.marker:
                 self.canvas.itemconfig(self.marker, state='normal')
+            self.wait_integrals(self.pyramid)
 
         except Exception as e:
             print(f"Ошибка загрузки изображения: {e}")
 
-    def resize_image(self, img):
-        original_width, original_height = img.size
-        width_scale = self.MAX_DISPLAY_WIDTH / original_width
-        height_scale = self.MAX_DISPLAY_HEIGHT / original_height
-        self.scale_factor = min(width_scale, height_scale)
+    def canvas_size(self):
+        width, height = self.canvas.winfo_width(), self.canvas.winfo_height()
+        if width <= 1 or height <= 1:
+            return self.MAX_DISPLAY_WIDTH, self.MAX_DISPLAY_HEIGHT
+        return width, height
+
+    def view_offset(self):
+        """Смещение изображения на Canvas: если оно меньше окна, то по центру"""
+        canvas_width, canvas_height = self.canvas_size()
+        x_offset = max(0.0, (canvas_width - self.image_size[0] * self.scale_factor) / 2)
+        y_offset = max(0.0, (canvas_height - self.image_size[1] * self.scale_factor) / 2)
+        return x_offset, y_offset
+
+    def to_canvas(self, x, y):
+        """Координаты изображения -> координаты Canvas"""
+        x_offset, y_offset = self.view_offset()
+        return ((x - self.view_x) * self.scale_factor + x_offset,
+                (y - self.view_y) * self.scale_factor + y_offset)
+
+    def to_image(self, canvas_x, canvas_y):
+        """Координаты Canvas -> координаты изображения"""
+        x_offset, y_offset = self.view_offset()
+        return (self.view_x + (canvas_x - x_offset) / self.scale_factor,
+                self.view_y + (canvas_y - y_offset) / self.scale_factor)
+
+    def clamp_view(self):
+        """Видимая область не выходит за пределы изображения"""
+        canvas_width, canvas_height = self.canvas_size()
+        max_x = self.image_size[0] - canvas_width / self.scale_factor
+        max_y = self.image_size[1] - canvas_height / self.scale_factor
+        self.view_x = min(max(0.0, self.view_x), max(0.0, max_x))
+        self.view_y = min(max(0.0, self.view_y), max(0.0, max_y))
+
+    def render(self):
+        """Отрисовка только видимых тайлов уровня пирамиды, подходящего к масштабу"""
+        if self.pyramid is None:
+            return
+
+        self.clamp_view()
+        canvas_width, canvas_height = self.canvas_size()
+        x_start, y_start = self.to_image(0, 0)
+        x_end, y_end = self.to_image(canvas_width, canvas_height)
+
+        level = self.pyramid.level_for_zoom(self.scale_factor)
+        span = self.pyramid.tile_size * 2 ** level
+        self.canvas.delete("tile")
+        for tx, ty in self.pyramid.tile_range(level, x_start, y_start, x_end, y_end):
+            tile = self.pyramid.tile(level, tx, ty)
+            # Края тайла округляются одинаково для соседей, поэтому между тайлами нет щелей
+            left, top = self.to_canvas(tx * span, ty * span)
+            right, bottom = self.to_canvas(min(tx * span + tile.shape[1] * 2 ** level, self.image_size[0]),
+                                           min(ty * span + tile.shape[0] * 2 ** level, self.image_size[1]))
+            left, top, right, bottom = (int(round(v)) for v in (left, top, right, bottom))
+            # Масштабируется только видимая часть тайла: при увеличении тайл бывает во много раз больше окна
+            x_first, x_last, left, right = self.visible_span(left, right, tile.shape[1], canvas_width)
+            y_first, y_last, top, bottom = self.visible_span(top, bottom, tile.shape[0], canvas_height)
+            if x_last <= x_first or y_last <= y_first:
+                continue
+            photo = self.tile_photo(level, tx, ty, tile, (x_first, y_first, x_last, y_last),
+                                    (max(1, right - left), max(1, bottom - top)))
+            self.canvas.create_image(left, top, anchor='nw', image=photo, tags=("tile", "image"))
+
+        if self.marker:
+            self.canvas.tag_raise(self.marker)
+        self.update_intensity()
+
+    @staticmethod
+    def visible_span(start, end, pixels, limit):
+        """
+        Видимая часть тайла вдоль одной оси: тайл из pixels пикселей занимает
+        [start, end) на Canvas шириной limit. Возвращает пиксели тайла [first, last)
+        и их края на Canvas (округлённые так же, как края целого тайла).
+        """
+        step = (end - start) / pixels
+        first = max(0, math.floor(-start / step))
+        last = min(pixels, math.ceil((limit - start) / step))
+        return first, last, int(round(start + first * step)), int(round(start + last * step))
+
+    def tile_photo(self, level, tx, ty, tile, box, size):
+        """
+        Видимая часть box тайла, масштабированная для экрана (с кэшем по уровню,
+        номеру, части и размеру). Кэш ограничен суммой пикселей PHOTO_CACHE_PIXELS.
+        """
+        key = (level, tx, ty, box, size)
+        entry = self.photo_cache.get(key)
+        if entry is None:
+            img = Image.fromarray(tile)
+            if box != (0, 0, img.width, img.height):
+                img = img.crop(box)
+            if img.size != size:
+                # При увеличении пиксели остаются чёткими, при уменьшении - сглаживаются
+                resample = Image.Resampling.NEAREST if size[0] > img.width else Image.Resampling.BILINEAR
+                img = img.resize(size, resample)
+            entry = (ImageTk.PhotoImage(img), size[0] * size[1])
+            self.photo_cache[key] = entry
+            self.photo_cache_pixels += entry[1]
+            while self.photo_cache_pixels > self.PHOTO_CACHE_PIXELS and len(self.photo_cache) > 1:
+                _, (_, pixels) = self.photo_cache.popitem(last=False)
+                self.photo_cache_pixels -= pixels
+        else:
+            self.photo_cache.move_to_end(key)
+        return entry[0]
+
+    def start_pan(self, event):
+        self.drag_start = (event.x, event.y, self.view_x, self.view_y)
+
+    def pan(self, event):
+        if self.pyramid is None or self.drag_start is None:
+            return
+        x, y, view_x, view_y = self.drag_start
+        self.view_x = view_x - (event.x - x) / self.scale_factor
+        self.view_y = view_y - (event.y - y) / self.scale_factor
+        self.render()
+
+    def zoom_at(self, canvas_x, canvas_y, steps):
+        """Изменение масштаба с сохранением точки изображения под курсором"""
+        if self.pyramid is None:
+            return
+        image_x, image_y = self.to_image(canvas_x, canvas_y)
+        canvas_width, canvas_height = self.canvas_size()
+        min_zoom = min(1.0, canvas_width / self.image_size[0], canvas_height / self.image_size[1])
+        self.scale_factor = min(self.MAX_ZOOM, max(min_zoom, self.scale_factor * self.ZOOM_STEP ** steps))
 
-        if self.scale_factor < 1:
-            new_size = (
-                int(original_width * self.scale_factor),
-                int(original_height * self.scale_factor)
-            )
-            return img.resize(new_size, Image.Resampling.LANCZOS)
-        return img
+        x_offset, y_offset = self.view_offset()
+        self.view_x = image_x - (canvas_x - x_offset) / self.scale_factor
+        self.view_y = image_y - (canvas_y - y_offset) / self.scale_factor
+        self.render()
 
     def update_intensity(self, *args):
         if self.pixels is None or not self.marker:
@@ -131,9 +274,16 @@ class PixelIntensityApp:
         x = int(self.x_slider.get())
         y = int(self.y_slider.get())
 
-        # Преобразование координат с учетом масштаба и смещения
-        display_x = x * self.scale_factor + self.display_params['x_offset']
-        display_y = y * self.scale_factor + self.display_params['y_offset']
+        # Преобразование координат с учетом масштаба и смещения (центр пикселя)
+        display_x, display_y = self.to_canvas(x + 0.5, y + 0.5)
+
+        # Движение слайдера за пределы видимой области сдвигает вид к маркеру
+        canvas_width, canvas_height = self.canvas_size()
+        if args and not (0 <= display_x <= canvas_width and 0 <= display_y <= canvas_height):
+            self.view_x = x + 0.5 - canvas_width / (2 * self.scale_factor)
+            self.view_y = y + 0.5 - canvas_height / (2 * self.scale_factor)
+            self.render()
+            return
 
         # Обновление позиции маркера
         self.canvas.coords(
@@ -146,6 +296,71 @@ class PixelIntensityApp:
         self.intensity_label.config(
             text=f"Интенсивность: {intensity} (X: {x}, Y: {y})"
         )
+        self.update_analysis(x, y)
+
+    def wait_integrals(self, pyramid):
+        """Опрос фонового построения таблиц сумм; по готовности - статистика для маркера"""
+        if pyramid is not self.pyramid:
+            return
+        if pyramid.integrals_ready():
+            self.update_intensity()
+        elif pyramid.integrals_building():
+            self.root.after(self.INTEGRALS_POLL_MS, self.wait_integrals, pyramid)
+        else:
+            self.roi_label.config(text="Не удалось построить таблицы сумм")
+
+    def roi_size(self):
+        try:
+            return max(1, self.roi_width.get()), max(1, self.roi_height.get())
+        except tk.TclError:
+            return self.ROI_DEFAULT, self.ROI_DEFAULT
+
+    def update_analysis(self, x, y):
+        """Статистика области вокруг маркера и профили строки и столбца через таблицы сумм"""
+        if not self.pyramid.integrals_ready():
+            # Профили прежнего изображения не показываются
+            self.row_profile.delete("all")
+            self.column_profile.delete("all")
+            if self.pyramid.integrals_building():
+                self.roi_label.config(text="Таблицы сумм строятся...")
+            return
+
+        width, height = self.roi_size()
+        x_start, y_start = x - width // 2, y - height // 2
+        stats = self.pyramid.roi_stats(x_start, y_start, x_start + width, y_start + height)
+        self.roi_label.config(
+            text=f"Пикселей: {stats['count']}  Сумма: {stats['sum']:.0f}  "
+                 f"Среднее: {stats['mean']:.2f}  Дисперсия: {stats['var']:.2f}  СКО: {stats['std']:.2f}"
+        )
+
+        # Рамка области на изображении
+        left, top = self.to_canvas(max(0, x_start), max(0, y_start))
+        right, bottom = self.to_canvas(min(self.image_size[0], x_start + width),
+                                       min(self.image_size[1], y_start + height))
+        self.canvas.delete("roi")
+        self.canvas.create_rectangle(left, top, right, bottom, outline='yellow', tags="roi")
+
+        # Профили по видимой части изображения, по интервалу на пиксель экрана
+        canvas_width, canvas_height = self.canvas_size()
+        view_x_start, view_y_start = self.to_image(0, 0)
+        view_x_end, view_y_end = self.to_image(canvas_width, canvas_height)
+        marker_x, marker_y = self.to_canvas(x + 0.5, y + 0.5)
+
+        positions, values = self.pyramid.row_profile(y, view_x_start, view_x_end, canvas_width)
+        points = [(self.to_canvas(position, 0)[0], self.PROFILE_SIZE * (1 - value / 255))
+                  for position, value in zip(positions, values)]
+        self.draw_profile(self.row_profile, points, (marker_x, 0, marker_x, self.PROFILE_SIZE))
+
+        positions, values = self.pyramid.column_profile(x, view_y_start, view_y_end, canvas_height)
+        points = [(self.PROFILE_SIZE * value / 255, self.to_canvas(0, position)[1])
+                  for position, value in zip(positions, values)]
+        self.draw_profile(self.column_profile, points, (0, marker_y, self.PROFILE_SIZE, marker_y))
+
+    def draw_profile(self, canvas, points, marker_line):
+        canvas.delete("all")
+        if len(points) > 1:
+            canvas.create_line(*[v for point in points for v in point], fill='blue')
+        canvas.create_line(*marker_line, fill='red')
 
 
 if __name__ == "__main__":
@@ -0,0 +1,82 @@
+from dataclasses import dataclass, fields, replace
+
+
+@dataclass(frozen=True)
+class JobConfig:
+    """
+    Неизменяемые настройки одного задания обработки. Передаются через все стадии
+    (кеограмма, поиск ярких областей, длины волн) вместо глобальных переменных
+    модулей, поэтому несколько заданий могут выполняться одновременно в одном
+    процессе или пуле без взаимного влияния.
+    """
+
+    # Кадры и результат
+    input_dir: str
+    output_path: str
+    gray_output_dir: object = None  # Полутоновая кеограмма (run_pipeline с save_intermediate)
+    time_start: object = None
+    time_end: object = None
+    use_frame_index: bool = True
+    frame_index_path: object = None
+    refresh_index: bool = False
+
+    # Фильтрация артефактов JPEG и вырезаемая область
+    median_blur_size: int = 19
+    bilateral_d: int = 2
+    bilateral_sigma_color: float = 10
+    bilateral_sigma_space: float = 10
+    crop_width: int = 30
+    crop_height: int = 2000
+    crop_first: bool = True
+    quick_look: int = 1
+
+    # Обработка и хранение
+    workers: int = 1
+    prefetch_readers: int = 4
+    read_ahead: int = 16
+    result_queue: int = 32
+    keogram_memmap: object = None
+    keogram_store: object = None
+    use_cache: bool = True
+    cache_dir: object = None
+    quality_screen: bool = True
+
+    # Поиск ярких областей
+    detect_output_dir: object = None
+    percentile: float = 99
+    min_area: float = 20
+    text_report: bool = True
+    detect_chunk_width: int = 8192
+    detect_marked_width: int = 16384
+    track_distance: object = 10
+    track_max_gap: int = 1
+
+    # Пиковые длины волн
+    stripe_width: int = 30
+
+    def replace(self, **changes):
+        """Копия настроек с заменой части полей"""
+        return replace(self, **changes)
+
+
+def default_config(**changes):
+    """
+    Настройки из текущих глобальных переменных модулей (прежний способ
+    настройки скриптов) с заменой полей из changes.
+    """
+    from src import Grey_fade
+    from src import Test_run_body as body
+    from src import Wavelegth_calc
+    from src import detector
+
+    values = {field.name: getattr(body, field.name.upper())
+              for field in fields(JobConfig) if hasattr(body, field.name.upper())}
+    values.update(gray_output_dir=Grey_fade.OUTPUT_DIR,
+                  detect_output_dir=detector.OUTPUT_DIR, percentile=detector.PERCENTILE,
+                  min_area=detector.MIN_AREA, text_report=detector.TEXT_REPORT,
+                  detect_chunk_width=detector.DETECT_CHUNK_WIDTH,
+                  detect_marked_width=detector.DETECT_MARKED_WIDTH,
+                  track_distance=detector.TRACK_DISTANCE, track_max_gap=detector.TRACK_MAX_GAP,
+                  stripe_width=Wavelegth_calc.STRIPE_WIDTH)
+    values.update(changes)
+    return JobConfig(**values)
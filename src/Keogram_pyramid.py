@@ -0,0 +1,338 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from src.Keogram_store import HEADER_NAME, KeogramStore, is_store, store_root
+
+# Размер тайла пирамиды в пикселях уровня
+TILE_SIZE = 256
+
+# Папка пирамиды рядом с изображением: keogram.png -> keogram.png.pyramid
+PYRAMID_SUFFIX = ".pyramid"
+
+# Ширина полосы столбцов при построении уровней (чётная), чтобы не держать уровень в памяти
+BUILD_CHUNK = 8192
+
+# Число тайлов, которые держатся в памяти
+TILE_CACHE_SIZE = 512
+
+# Число профилей строк и столбцов, которые держатся в памяти
+PROFILE_CACHE_SIZE = 64
+
+# Таблицы сумм (интегральные изображения) уровня 0 внутри папки пирамиды
+INTEGRAL_NAMES = ("integral_sum.npy", "integral_sqsum.npy")
+
+
+def pyramid_dir(source_path, cache_dir=None):
+    """Папка с уровнями пирамиды для изображения"""
+    source_path = Path(source_path)
+    if cache_dir:
+        return Path(cache_dir) / f"{source_path.name}{PYRAMID_SUFFIX}"
+    return source_path.with_name(f"{source_path.name}{PYRAMID_SUFFIX}")
+
+
+def load_intensity(source_path):
+    """
+    Полутоновое изображение полного разрешения (.npy открывается как np.memmap,
+    у хранилища кеограммы берётся полутоновая плоскость без копирования)
+    """
+    source_path = Path(source_path)
+    if is_store(source_path):
+        return KeogramStore(source_path).gray
+    if source_path.suffix.lower() == '.npy':
+        data = np.load(source_path, mmap_mode='r')
+        if data.ndim == 3:
+            return convert_chunked(data)
+        return data
+
+    gray = cv2.imread(str(source_path), cv2.IMREAD_GRAYSCALE)
+    if gray is None:
+        raise ValueError(f"Не удалось загрузить {source_path}")
+    return gray
+
+
+def convert_chunked(color):
+    """Перевод цветного массива (в т.ч. memmap) в оттенки серого полосами столбцов"""
+    gray = np.empty(color.shape[:2], dtype=np.uint8)
+    for x in range(0, color.shape[1], BUILD_CHUNK):
+        chunk = np.ascontiguousarray(color[:, x:x + BUILD_CHUNK])
+        gray[:, x:x + BUILD_CHUNK] = cv2.cvtColor(chunk, cv2.COLOR_BGR2GRAY)
+    return gray
+
+
+def downsample(level):
+    """Следующий уровень: среднее по блокам 2x2 (нечётный край повторяется), полосами столбцов"""
+    height, width = level.shape
+    out = np.empty(((height + 1) // 2, (width + 1) // 2), dtype=np.uint8)
+    for x in range(0, width, BUILD_CHUNK):
+        chunk = np.asarray(level[:, x:x + BUILD_CHUNK], dtype=np.uint16)
+        if chunk.shape[0] % 2:
+            chunk = np.vstack([chunk, chunk[-1:]])
+        if chunk.shape[1] % 2:
+            chunk = np.hstack([chunk, chunk[:, -1:]])
+        blocks = chunk[0::2, 0::2] + chunk[1::2, 0::2] + chunk[0::2, 1::2] + chunk[1::2, 1::2]
+        out[:, x // 2:x // 2 + blocks.shape[1]] = (blocks + 2) // 4
+    return out
+
+
+def source_stat(source_path):
+    """Версия исходного файла: у хранилища кеограммы меняется файл описания при каждом дописывании"""
+    if is_store(source_path):
+        return (store_root(source_path) / HEADER_NAME).stat()
+    return Path(source_path).stat()
+
+
+def build_pyramid(source_path, out_dir, tile_size=TILE_SIZE):
+    """
+    Построение пирамиды: уровень 0 - полутоновое изображение полного разрешения,
+    каждый следующий уменьшен вдвое, пока уровень не поместится в один тайл.
+    Уровни хранятся в .npy и открываются как np.memmap; уровнем 0 хранилища
+    кеограммы служит его полутоновая плоскость, она не копируется.
+    """
+    source_path, out_dir = Path(source_path), Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    # Таблицы сумм от прежней версии изображения больше не действительны
+    for name in INTEGRAL_NAMES:
+        try:
+            (out_dir / name).unlink()
+        except OSError:
+            pass
+
+    level = load_intensity(source_path)
+    shapes = []
+    index = 0
+    while True:
+        if index == 0 and is_store(source_path):
+            stored = level
+        else:
+            stored = np.lib.format.open_memmap(out_dir / f"level_{index}.npy", mode='w+',
+                                               dtype=np.uint8, shape=level.shape)
+            for x in range(0, level.shape[1], BUILD_CHUNK):
+                stored[:, x:x + BUILD_CHUNK] = level[:, x:x + BUILD_CHUNK]
+            stored.flush()
+        shapes.append(list(level.shape))
+        if max(level.shape) <= tile_size:
+            break
+        level = downsample(stored)
+        del stored
+        index += 1
+
+    # Описание пишется последним: без него пирамида считается недостроенной
+    stat = source_stat(source_path)
+    meta = {'source': str(source_path.resolve()), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+            'tile_size': tile_size, 'levels': shapes}
+    tmp = out_dir / "pyramid.json.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+    os.replace(tmp, out_dir / "pyramid.json")
+    return meta
+
+
+def build_integrals(level, out_dir):
+    """
+    Таблицы сумм и сумм квадратов (cv2.integral2) для изображения полного
+    разрешения. Считаются полосами столбцов: к локальной таблице полосы
+    прибавляется накопленная сумма слева. Значения float64 точны до 2^53,
+    поэтому суммы целых яркостей не теряют точности.
+    """
+    out_dir = Path(out_dir)
+    height, width = level.shape
+    tables = []
+    for name in INTEGRAL_NAMES:
+        table = np.lib.format.open_memmap(out_dir / f"{name}.tmp", mode='w+',
+                                          dtype=np.float64, shape=(height + 1, width + 1))
+        table[:, 0] = 0
+        tables.append(table)
+
+    for x in range(0, width, BUILD_CHUNK):
+        chunk = np.ascontiguousarray(level[:, x:x + BUILD_CHUNK])
+        local = cv2.integral2(chunk, sdepth=cv2.CV_64F, sqdepth=cv2.CV_64F)
+        for table, part in zip(tables, local):
+            table[:, x + 1:x + 1 + chunk.shape[1]] = part[:, 1:] + table[:, x:x + 1]
+
+    # Файлы должны быть закрыты до переименования (Windows)
+    for table in tables:
+        table.flush()
+    del table, tables, local
+    for name in INTEGRAL_NAMES:
+        os.replace(out_dir / f"{name}.tmp", out_dir / name)
+
+
+def read_meta(out_dir, source_path, tile_size):
+    """Описание пирамиды, если она построена для текущей версии файла, иначе None"""
+    try:
+        with open(Path(out_dir) / "pyramid.json", encoding='utf-8') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    stat = source_stat(source_path)
+    if (meta.get('size'), meta.get('mtime_ns'), meta.get('tile_size')) != (stat.st_size, stat.st_mtime_ns,
+                                                                          tile_size):
+        return None
+    return meta
+
+
+class KeogramPyramid:
+    """
+    Многоуровневая тайловая пирамида изображения для просмотра очень широких
+    кеограмм. Строится один раз и кэшируется на диске; уровни открываются как
+    np.memmap, поэтому в память попадают только запрошенные тайлы.
+    """
+
+    def __init__(self, source_path, cache_dir=None, tile_size=TILE_SIZE):
+        self.source_path = store_root(source_path) if is_store(source_path) else Path(source_path)
+        self.tile_size = tile_size
+        self.dir = pyramid_dir(self.source_path, cache_dir)
+
+        meta = read_meta(self.dir, self.source_path, tile_size)
+        if meta is None:
+            meta = build_pyramid(self.source_path, self.dir, tile_size)
+        self.levels = [np.load(self.dir / f"level_{i}.npy", mmap_mode='r') for i in range(len(meta['levels']))
+                       if i > 0 or not is_store(self.source_path)]
+        if is_store(self.source_path):
+            self.levels.insert(0, KeogramStore(self.source_path).gray)
+
+        self.lock = threading.Lock()
+        self.tiles = OrderedDict()
+        self.integrals = None
+        self.integrals_thread = None
+        self.profiles = OrderedDict()
+
+    @property
+    def width(self):
+        return self.levels[0].shape[1]
+
+    @property
+    def height(self):
+        return self.levels[0].shape[0]
+
+    def level_for_zoom(self, zoom):
+        """Уровень, у которого на пиксель экрана приходится не меньше пикселя уровня"""
+        level = 0
+        while level + 1 < len(self.levels) and zoom * 2 ** (level + 1) <= 1:
+            level += 1
+        return level
+
+    def tile_range(self, level, x_start, y_start, x_end, y_end):
+        """Номера тайлов уровня (tx, ty), пересекающих область в координатах уровня 0"""
+        span = self.tile_size * 2 ** level
+        height, width = self.levels[level].shape
+        tx_end = min(-(-int(np.ceil(x_end)) // span), -(-width // self.tile_size))
+        ty_end = min(-(-int(np.ceil(y_end)) // span), -(-height // self.tile_size))
+        return [(tx, ty)
+                for ty in range(max(0, int(y_start) // span), ty_end)
+                for tx in range(max(0, int(x_start) // span), tx_end)]
+
+    def tile(self, level, tx, ty):
+        """Тайл уровня (копия в памяти, с вытеснением давно не использованных)"""
+        key = (level, tx, ty)
+        with self.lock:
+            tile = self.tiles.get(key)
+            if tile is not None:
+                self.tiles.move_to_end(key)
+                return tile
+
+        size = self.tile_size
+        tile = np.array(self.levels[level][ty * size:(ty + 1) * size, tx * size:(tx + 1) * size])
+        with self.lock:
+            self.tiles[key] = tile
+            while len(self.tiles) > TILE_CACHE_SIZE:
+                self.tiles.popitem(last=False)
+        return tile
+
+    def intensity(self, x, y):
+        """Интенсивность пикселя полного разрешения"""
+        return self.levels[0][y, x]
+
+    def integral_tables(self):
+        """
+        Таблицы сумм и сумм квадратов (строятся при первом запросе и кэшируются
+        на диске; если уже строятся в фоне - ожидание построения)
+        """
+        thread = self.integrals_thread
+        if thread is not None:
+            thread.join()
+        if self.integrals is None:
+            self._load_integrals()
+        return self.integrals
+
+    def _load_integrals(self):
+        if not all((self.dir / name).exists() for name in INTEGRAL_NAMES):
+            build_integrals(self.levels[0], self.dir)
+        self.integrals = tuple(np.load(self.dir / name, mmap_mode='r') for name in INTEGRAL_NAMES)
+
+    def build_integrals_async(self):
+        """Построение таблиц сумм в фоновом потоке (для просмотрщика: окно не замирает)"""
+        with self.lock:
+            if self.integrals is None and self.integrals_thread is None:
+                self.integrals_thread = threading.Thread(target=self._load_integrals, daemon=True)
+                self.integrals_thread.start()
+
+    def integrals_ready(self):
+        """Готовы ли таблицы сумм; сами таблицы при этом не строятся"""
+        if (self.integrals is None and self.integrals_thread is None
+                and all((self.dir / name).exists() for name in INTEGRAL_NAMES)):
+            self._load_integrals()
+        return self.integrals is not None
+
+    def integrals_building(self):
+        return self.integrals_thread is not None and self.integrals_thread.is_alive()
+
+    def roi_stats(self, x_start, y_start, x_end, y_end):
+        """
+        Сумма, среднее, дисперсия и СКО по прямоугольнику [x_start, x_end) x [y_start, y_end)
+        за O(1) - по четырём значениям каждой таблицы сумм.
+        """
+        x_start, x_end = max(0, x_start), min(self.width, x_end)
+        y_start, y_end = max(0, y_start), min(self.height, y_end)
+        count = max(0, x_end - x_start) * max(0, y_end - y_start)
+        if count == 0:
+            return {'count': 0, 'sum': 0.0, 'mean': 0.0, 'var': 0.0, 'std': 0.0}
+
+        total, total_sq = (table[y_end, x_end] - table[y_start, x_end] - table[y_end, x_start]
+                           + table[y_start, x_start] for table in self.integral_tables())
+        mean = total / count
+        var = max(0.0, total_sq / count - mean * mean)
+        return {'count': count, 'sum': float(total), 'mean': float(mean),
+                'var': float(var), 'std': float(np.sqrt(var))}
+
+    def row_profile(self, y, x_start, x_end, bins):
+        """Средняя яркость строки y в bins интервалах по [x_start, x_end) (по таблице сумм)"""
+        return self._profile('row', y, x_start, x_end, bins)
+
+    def column_profile(self, x, y_start, y_end, bins):
+        """Средняя яркость столбца x в bins интервалах по [y_start, y_end) (по таблице сумм)"""
+        return self._profile('column', x, y_start, y_end, bins)
+
+    def _profile(self, axis, index, start, end, bins):
+        limit = self.width if axis == 'row' else self.height
+        start, end = max(0, int(start)), min(limit, int(np.ceil(end)))
+        key = (axis, index, start, end, bins)
+        with self.lock:
+            profile = self.profiles.get(key)
+            if profile is not None:
+                self.profiles.move_to_end(key)
+                return profile
+
+        # Границы интервалов; при увеличении интервал не короче одного пикселя
+        edges = np.unique(np.linspace(start, end, max(1, min(bins, end - start)) + 1).astype(np.int64))
+        table = self.integral_tables()[0]
+        if axis == 'row':
+            cumulative = table[index + 1, edges] - table[index, edges]
+        else:
+            cumulative = table[edges, index + 1] - table[edges, index]
+        positions = (edges[:-1] + edges[1:]) / 2
+        profile = (positions, np.diff(cumulative) / np.diff(edges))
+
+        with self.lock:
+            self.profiles[key] = profile
+            while len(self.profiles) > PROFILE_CACHE_SIZE:
+                self.profiles.popitem(last=False)
+        return profile
@@ -0,0 +1,210 @@
+import csv
+import json
+import os
+import threading
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from src.Grey_fade import convert_to_grayscale
+
+# Файлы хранилища внутри папки <имя>.keogram
+STORE_SUFFIX = ".keogram"
+HEADER_NAME = "header.json"
+PIXELS_NAME = "pixels.raw"
+GRAY_NAME = "gray.raw"
+COLUMNS_NAME = "columns.csv"
+
+# Строка описания на каждую дописанную полосу
+COLUMN_FIELDS = ('first_column', 'width', 'captured', 'frame')
+
+
+def store_root(path):
+    """Папка хранилища по пути к ней или к её файлу описания"""
+    path = Path(path)
+    return path.parent if path.name == HEADER_NAME else path
+
+
+def is_store(path):
+    return (store_root(path) / HEADER_NAME).is_file()
+
+
+class KeogramStore:
+    """
+    Хранилище кеограммы без потерь: столбцы пишутся подряд в сырой файл
+    (столбец за столбцом, поэтому дописывание - это запись в конец файла),
+    рядом - полутоновая плоскость и описание полос (время съёмки и имя кадра).
+    Чтение идёт через np.memmap без копирования: pixels и gray - представления
+    (высота, ширина[, 3]) поверх файлов. Ширина в header.json - точка фиксации:
+    хвост, дописанный после неё (например, при сбое), отбрасывается.
+    """
+
+    def __init__(self, path, mode='r'):
+        self.path = store_root(path)
+        self.mode = mode
+        self.lock = threading.Lock()
+        self.height = None
+        self.channels = 3
+        self.width = 0
+
+        if (self.path / HEADER_NAME).exists():
+            with open(self.path / HEADER_NAME, encoding='utf-8') as f:
+                header = json.load(f)
+            self.height, self.channels, self.width = header['height'], header['channels'], header['width']
+        elif mode == 'r':
+            raise FileNotFoundError(f"Хранилище кеограммы не найдено: {self.path}")
+
+        if mode == 'a':
+            self.path.mkdir(parents=True, exist_ok=True)
+            self._truncate()
+
+    @classmethod
+    def create(cls, path):
+        """Новое (пустое) хранилище для записи; прежнее содержимое папки удаляется"""
+        root = store_root(path)
+        for name in (HEADER_NAME, PIXELS_NAME, GRAY_NAME, COLUMNS_NAME):
+            try:
+                (root / name).unlink()
+            except OSError:
+                pass
+        return cls(root, mode='a')
+
+    def _truncate(self):
+        """Отбрасывание данных, дописанных после последней фиксации"""
+        sizes = {PIXELS_NAME: self.width * (self.height or 0) * self.channels,
+                 GRAY_NAME: self.width * (self.height or 0)}
+        for name, size in sizes.items():
+            file_path = self.path / name
+            if file_path.exists() and file_path.stat().st_size > size:
+                with open(file_path, 'r+b') as f:
+                    f.truncate(size)
+
+        # Описания полос за пределами зафиксированной ширины тоже отбрасываются
+        columns = self.columns()
+        if (self.path / COLUMNS_NAME).exists() and len(columns['frame']) < self._column_rows():
+            with open(self.path / COLUMNS_NAME, 'w', newline='', encoding='utf-8') as f:
+                writer = csv.writer(f)
+                writer.writerow(COLUMN_FIELDS)
+                writer.writerows(zip(*(columns[key].tolist() for key in COLUMN_FIELDS)))
+
+    def _column_rows(self):
+        with open(self.path / COLUMNS_NAME, newline='', encoding='utf-8') as f:
+            return sum(1 for _ in csv.DictReader(f))
+
+    def _write_header(self):
+        header = {'height': self.height, 'channels': self.channels, 'width': self.width}
+        tmp = self.path / f"{HEADER_NAME}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(header, f)
+        os.replace(tmp, self.path / HEADER_NAME)
+
+    def append(self, strip, frame='', captured=''):
+        """
+        Дописывание полосы кадра. Высота хранилища задаётся первой полосой;
+        более высокие полосы обрезаются, более низкие дополняются нулями.
+        """
+        if self.mode != 'a':
+            raise ValueError("Хранилище открыто только для чтения")
+
+        with self.lock:
+            if self.height is None:
+                self.height = strip.shape[0]
+            if strip.shape[0] != self.height:
+                fitted = np.zeros((self.height,) + strip.shape[1:], dtype=np.uint8)
+                rows = min(self.height, strip.shape[0])
+                fitted[:rows] = strip[:rows]
+                strip = fitted
+
+            # Столбцы подряд: (ширина, высота, каналы)
+            with open(self.path / PIXELS_NAME, 'ab') as f:
+                f.write(np.ascontiguousarray(strip.transpose(1, 0, 2)).tobytes())
+            with open(self.path / GRAY_NAME, 'ab') as f:
+                f.write(np.ascontiguousarray(convert_to_grayscale(strip).T).tobytes())
+
+            columns_path = self.path / COLUMNS_NAME
+            new_file = not columns_path.exists()
+            with open(columns_path, 'a', newline='', encoding='utf-8') as f:
+                writer = csv.writer(f)
+                if new_file:
+                    writer.writerow(COLUMN_FIELDS)
+                writer.writerow((self.width, strip.shape[1], str(captured or ''), frame))
+
+            self.width += strip.shape[1]
+            self._write_header()
+
+    def refresh(self):
+        """Перечитывание описания (хранилище может дописываться другим процессом)"""
+        if (self.path / HEADER_NAME).exists():
+            with open(self.path / HEADER_NAME, encoding='utf-8') as f:
+                header = json.load(f)
+            self.height, self.channels, self.width = header['height'], header['channels'], header['width']
+        return self.width
+
+    @property
+    def pixels(self):
+        """Цветная кеограмма (высота, ширина, 3) - представление np.memmap без копирования"""
+        if not self.width:
+            return None
+        columns = np.memmap(self.path / PIXELS_NAME, dtype=np.uint8, mode='r',
+                            shape=(self.width, self.height, self.channels))
+        return columns.transpose(1, 0, 2)
+
+    @property
+    def gray(self):
+        """Полутоновая кеограмма (высота, ширина) - представление np.memmap без копирования"""
+        if not self.width:
+            return None
+        columns = np.memmap(self.path / GRAY_NAME, dtype=np.uint8, mode='r',
+                            shape=(self.width, self.height))
+        return columns.T
+
+    def columns(self):
+        """Описание полос: словарь массивов first_column, width, captured, frame"""
+        rows = []
+        try:
+            with open(self.path / COLUMNS_NAME, newline='', encoding='utf-8') as f:
+                rows = [row for row in csv.DictReader(f)
+                        if int(row['first_column']) + int(row['width']) <= self.width]
+        except OSError:
+            pass
+        return {
+            'first_column': np.array([int(row['first_column']) for row in rows], dtype=np.int64),
+            'width': np.array([int(row['width']) for row in rows], dtype=np.int64),
+            'captured': np.array([row['captured'] for row in rows], dtype=str),
+            'frame': np.array([row['frame'] for row in rows], dtype=str),
+        }
+
+    def column_frames(self):
+        """Время съёмки и имя кадра для каждого столбца кеограммы"""
+        columns = self.columns()
+        return np.repeat(columns['captured'], columns['width']), np.repeat(columns['frame'], columns['width'])
+
+
+def export_keogram(store_path, image_path, quality=None):
+    """
+    Отдельный шаг отрисовки: сохранение хранилища в JPEG/PNG.
+    quality - качество JPEG (None - по умолчанию OpenCV).
+    """
+    pixels = KeogramStore(store_path).pixels
+    if pixels is None:
+        raise ValueError(f"Хранилище кеограммы пусто: {store_path}")
+
+    params = []
+    if quality is not None and Path(image_path).suffix.lower() in {'.jpg', '.jpeg'}:
+        params = [cv2.IMWRITE_JPEG_QUALITY, int(quality)]
+    if not cv2.imwrite(str(image_path), np.ascontiguousarray(pixels), params):
+        raise ValueError(f"Не удалось сохранить {image_path}")
+    return image_path
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Экспорт хранилища кеограммы в изображение")
+    parser.add_argument('store', help="папка хранилища (.keogram)")
+    parser.add_argument('image', help="файл изображения (.png, .jpg, ...)")
+    parser.add_argument('--quality', type=int, default=None, help="качество JPEG")
+    args = parser.parse_args()
+
+    print(f"Сохранено: {export_keogram(args.store, args.image, args.quality)}")
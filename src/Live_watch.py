@@ -0,0 +1,178 @@
+import threading
+from functools import partial
+from pathlib import Path
+
+import numpy as np
+
+from src import Test_run_body as body
+from src.detector import DetectionResults, brightness_histogram, detect_regions, region_tracker
+from src.Frame_index import capture_times
+from src.Job_config import default_config
+from src.Keogram_store import STORE_SUFFIX, KeogramStore, export_keogram
+
+# Период опроса папки с кадрами, секунды
+POLL_INTERVAL = 5.0
+
+# Области, касающиеся последнего столбца, ждут продолжения в следующих кадрах,
+# но не дольше: более длинные области записываются частями
+LIVE_MAX_OPEN = 4096
+
+# Число опросов, в которые кадр пробуют обработать, прежде чем пропустить его
+LIVE_MAX_ATTEMPTS = 3
+
+
+class LiveKeogram:
+    """
+    Режим наблюдения за папкой: новые кадры обрабатываются по мере появления,
+    их полосы дописываются в хранилище кеограммы (config.keogram_store или
+    <output_path>.keogram), а поиск ярких областей запускается по новым столбцам.
+    Области, касающиеся последнего столбца, ещё могут продолжиться: они
+    записываются только после повторного поиска вместе со следующими столбцами,
+    поэтому область на границе порций не делится. Порог считается по гистограмме,
+    накопленной по всей кеограмме. Изображение кеограммы сохраняется по запросу (save).
+    """
+
+    def __init__(self, input_dir=None, output_path=None, output_dir=None, config=None):
+        self.config = config or default_config()
+        self.input_dir = Path(input_dir or self.config.input_dir)
+        self.output_path = Path(output_path or self.config.output_path)
+        self.output_dir = Path(output_dir or self.config.detect_output_dir)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+
+        self.store = KeogramStore.create(self.config.keogram_store
+                                         or self.output_path.with_suffix(STORE_SUFFIX))
+        self.histogram = np.zeros(256, dtype=np.int64)
+        self.detected_to = 0  # Области, закончившиеся левее, уже записаны
+        self.open_from = 0  # Начало самой левой незавершённой области
+        self.batch_name = ''  # Первый кадр последней порции - имя записи результатов
+        # Треки связывают области соседних порций столбцов (координаты - во всей кеограмме)
+        self.results = DetectionResults(self.output_dir, self.config.text_report, self.config.percentile,
+                                        region_tracker(self.config))
+        self.processed = set()
+        self.pending_sizes = {}
+        self.failures = {}  # Число неудачных попыток обработки кадра
+
+        self.process = partial(body.process_image, config=self.config)
+        cache = body.frame_cache(self.input_dir, self.config)
+        if cache is not None:
+            self.process = cache.cached(self.process, body.cache_params(self.config))
+
+    def ready_frames(self):
+        """Новые кадры, размер которых не изменился с прошлого опроса (запись завершена)"""
+        ready = []
+        for img_path in body.get_image_files(self.input_dir):
+            if img_path in self.processed:
+                continue
+            try:
+                stat = img_path.stat()
+            except OSError:
+                continue
+            if self.pending_sizes.get(img_path) == stat.st_size:
+                ready.append((stat.st_mtime_ns, img_path.name, img_path))
+            else:
+                self.pending_sizes[img_path] = stat.st_size
+
+        # Порядок кадров - по времени изменения, затем по имени (кадр мог быть удалён после опроса)
+        ready.sort()
+        return [img_path for _, _, img_path in ready]
+
+    def poll(self):
+        """Один опрос папки: обработка готовых кадров и детекция по новым столбцам"""
+        frames = self.ready_frames()
+        if not frames:
+            return 0
+
+        start = self.store.width
+        times = capture_times(frames, self.config.frame_index_path)
+        for img_path, cropped in body.process_images_parallel(frames, self.process, self.config.workers):
+            if cropped is None:
+                # Кадр не прочитался (например, ещё дописывается): повтор в следующих опросах
+                self.failures[img_path] = self.failures.get(img_path, 0) + 1
+                if self.failures[img_path] < LIVE_MAX_ATTEMPTS:
+                    continue
+                print(f"Кадр пропущен после {LIVE_MAX_ATTEMPTS} попыток: {img_path.name}")
+            else:
+                self.store.append(cropped, img_path.name, times[img_path])
+                print(f"Обработано: {img_path.name}")
+            self.processed.add(img_path)
+            self.pending_sizes.pop(img_path, None)
+            self.failures.pop(img_path, None)
+
+        if self.store.width == start:
+            return len(frames)
+
+        self.histogram += brightness_histogram(self.store.gray[:, start:])
+        self.batch_name = frames[0].name
+        self.detect()
+        return len(frames)
+
+    def detect(self, final=False):
+        """
+        Поиск ярких областей по новым столбцам и заново - по столбцам незавершённых
+        областей. final - записать и области, касающиеся последнего столбца.
+        """
+        width = self.store.width
+        window_start = self.open_from
+        if window_start >= width:
+            return
+
+        gray = np.ascontiguousarray(self.store.gray[:, window_start:width])
+        regions, contours, threshold, _ = detect_regions(gray, self.config.percentile, self.histogram,
+                                                         self.config.min_area)
+
+        # Координаты областей - в системе всей кеограммы
+        regions['x'] = regions['x'] + window_start
+        regions['cx'] = regions['cx'] + window_start
+        end = regions['x'] + regions['w']
+
+        # Закончившиеся до прошлой границы уже записаны; касающиеся последнего столбца ждут
+        waiting = (end == width) & (regions['x'] >= width - LIVE_MAX_OPEN) & (not final)
+        ready = (end >= self.detected_to) & ~waiting
+        self.detected_to = width
+        self.open_from = int(regions['x'][waiting].min()) if waiting.any() else width
+
+        regions = {key: column[ready] for key, column in regions.items()}
+        regions['points'] = np.array([len(cnt) for cnt, keep in zip(contours, ready) if keep], dtype=np.int64)
+        self.results.add(self.batch_name, threshold, regions)
+
+    def close(self):
+        """Запись незавершённых областей и закрытие результатов"""
+        self.detect(final=True)
+        self.results.close()
+
+    def save(self):
+        """Сохранение изображения кеограммы из хранилища (результат - представление хранилища)"""
+        keogram = self.store.pixels
+        if keogram is not None:
+            export_keogram(self.store.path, self.output_path)
+        return keogram
+
+    def run(self, stop_event=None, poll_interval=None, max_polls=None):
+        """Опрос папки до установки stop_event (или max_polls опросов)"""
+        stop_event = stop_event or threading.Event()
+        poll_interval = POLL_INTERVAL if poll_interval is None else poll_interval
+
+        polls = 0
+        try:
+            while not stop_event.is_set() and (max_polls is None or polls < max_polls):
+                self.poll()
+                polls += 1
+                stop_event.wait(poll_interval)
+        finally:
+            self.close()
+            self.save()
+
+
+def watch(input_dir=None, poll_interval=None):
+    """Наблюдение за папкой с кадрами до прерывания с клавиатуры"""
+    live = LiveKeogram(input_dir)
+    print(f"Наблюдение за папкой: {live.input_dir}")
+    try:
+        live.run(poll_interval=poll_interval)
+    except KeyboardInterrupt:
+        pass
+    print(f"Кеограмма сохранена в: {live.output_path}")
+
+
+if __name__ == "__main__":
+    watch()
@@ -0,0 +1,114 @@
+import cv2
+import numpy as np
+
+from src import Test_run_body as body
+from src.Job_config import default_config
+
+# Срезы по умолчанию: меридиан N-S (вертикальный) и E-W (горизонтальный).
+# angle - угол линии через зенит от вертикали в градусах, width - ширина
+# выборки поперёк линии, length - длина вдоль линии. None - ширина и высота
+# фрагмента основной кеограммы (crop_width, crop_height), поэтому срез N-S
+# совпадает с ней; длина обрезается краями кадра (наклонные - меньшей стороной)
+DEFAULT_SLICES = [
+    {'name': 'NS', 'angle': 0, 'width': None, 'length': None},
+    {'name': 'EW', 'angle': 90, 'width': None, 'length': None},
+]
+
+
+def slice_maps(shape, angle, width, length):
+    """
+    Карты координат для cv2.remap: строка результата идёт вдоль линии через
+    центр кадра под углом angle, столбец - поперёк неё.
+    """
+    h, w = shape[:2]
+    theta = np.deg2rad(angle)
+    along = np.arange(length, dtype=np.float32) - (length - 1) / 2
+    across = np.arange(width, dtype=np.float32) - (width - 1) / 2
+
+    # Направление вдоль линии (при angle=0 - сверху вниз) и поперёк неё
+    dx, dy = np.sin(theta), np.cos(theta)
+    nx, ny = np.cos(theta), -np.sin(theta)
+    map_x = (w - 1) / 2 + along[:, None] * dx + across[None, :] * nx
+    map_y = (h - 1) / 2 + along[:, None] * dy + across[None, :] * ny
+    return map_x.astype(np.float32), map_y.astype(np.float32)
+
+
+class SliceSampler:
+    """
+    Выборка всех срезов из одного декодированного кадра.
+    Вертикальные и горизонтальные срезы вырезаются напрямую с фильтрацией,
+    совпадающей с основной кеограммой; наклонные - билинейной выборкой через
+    cv2.remap по картам, которые считаются один раз на размер кадра.
+    """
+
+    def __init__(self, slices=None, params=None, config=None):
+        self.slices = slices or DEFAULT_SLICES
+        self.params = params or body.filter_params(config)
+        self.maps = {}
+
+    def _maps(self, shape, angle, width, length):
+        key = (shape[:2], angle, width, length)
+        if key not in self.maps:
+            self.maps[key] = slice_maps(shape, angle, width, length)
+        return self.maps[key]
+
+    def slice_size(self, spec):
+        """Ширина и длина среза (по умолчанию - размеры фрагмента основной кеограммы)"""
+        crop_width, crop_height = self.params[4:6]
+        return spec['width'] or crop_width, spec['length'] or crop_height
+
+    def sample(self, img):
+        """Список полос (длина x ширина) для каждого среза"""
+        median_size, bilateral_d, sigma_color, sigma_space = self.params[:4]
+        strips = []
+        for spec in self.slices:
+            width, length = self.slice_size(spec)
+            angle = spec['angle'] % 180
+            reverse = spec['angle'] % 360 >= 180
+
+            if angle == 0:
+                strip = body.filter_center_crop(img, *self.params[:4], width, length)
+            elif angle == 90:
+                # Строки полосы идут слева направо, столбцы - снизу вверх, как при remap
+                strip = body.filter_center_crop(img, *self.params[:4], length, width)
+                strip = strip.swapaxes(0, 1)[:, ::-1]
+            else:
+                # Наклонная линия длиннее меньшей стороны выходит за пределы кадра
+                map_x, map_y = self._maps(img.shape, spec['angle'], width, min(length, min(img.shape[:2])))
+                strip = cv2.remap(img, map_x, map_y, cv2.INTER_LINEAR,
+                                  borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+                # Фильтрация наклонной полосы после выборки - приближение к основной кеограмме
+                strip = cv2.bilateralFilter(cv2.medianBlur(strip, median_size),
+                                            d=bilateral_d, sigmaColor=sigma_color,
+                                            sigmaSpace=sigma_space)
+                reverse = False
+
+            if reverse:
+                strip = strip[::-1, ::-1]
+            strips.append(np.ascontiguousarray(strip))
+        return strips
+
+
+def build_multi_keograms(image_files, slices=None, workers=None, config=None):
+    """
+    Кеограммы для нескольких срезов за один проход декодирования.
+    Возвращает словарь: имя среза - кеограмма.
+    """
+    config = config or default_config()
+    sampler = SliceSampler(slices, config=config)
+
+    def process(img_path):
+        img = body.read_frame(img_path, config.quick_look)
+        if img is None:
+            print(f"Ошибка загрузки: {img_path.name}")
+            return None
+        return sampler.sample(img)
+
+    writers = [body.KeogramWriter(len(image_files), sampler.slice_size(spec)[0]) for spec in sampler.slices]
+    for img_path, strips in body.process_images_parallel(image_files, process, workers or config.workers):
+        if strips is None:
+            continue
+        for writer, strip in zip(writers, strips):
+            writer.append(strip)
+
+    return {spec['name']: writer.result() for spec, writer in zip(sampler.slices, writers)}
@@ -4,6 +4,7 @@ from pathlib import Path
 
 from src.Grey_fade import grey_scale
 from src.detector import detect
+from src.Test_run_body import KeogramWriter
 
 stripw = 3
 
@@ -24,21 +25,10 @@ def extract_central_strip(img):
 
 def combine_strips(strips):
     """Combine all strips horizontally"""
-    min_height = min(s.shape[0] for s in strips)
-    total_width = sum(s.shape[1] for s in strips)
-
-    # Create blank canvas (handles both color and grayscale)
-    if strips[0].ndim == 3:
-        combined = np.zeros((min_height, total_width, 3), dtype=np.uint8)
-    else:
-        combined = np.zeros((min_height, total_width), dtype=np.uint8)
-
-    x = 0
+    writer = KeogramWriter(len(strips), max(s.shape[1] for s in strips))
     for strip in strips:
-        h = min(min_height, strip.shape[0])
-        combined[:h, x:x + strip.shape[1]] = strip[:h]
-        x += strip.shape[1]
-    return combined
+        writer.append(strip)
+    return writer.result()
 
 def apply_jpg_artifact_reduction(img):
     """Фильтрация артефактов сжатия JPEG"""
@@ -69,7 +59,8 @@ def main():
 
     print(f"Found {len(image_files)} images in '{input_dir}'")
 
-    strips = []
+    # Strips go straight into the preallocated keogram
+    writer = KeogramWriter(len(image_files), stripw)
     for img_path in image_files:
         img = cv2.imread(str(img_path), cv2.IMREAD_UNCHANGED)
         if img is None:
@@ -81,18 +72,18 @@ def main():
 
         try:
             strip = extract_central_strip(img)
-            strips.append(strip)
+            writer.append(strip)
             print(f"Processed: {img_path.name}")
         except Exception as e:
             print(f"Error processing {img_path.name}: {str(e)}")
             continue
 
-    if not strips:
+    result = writer.result()
+    if result is None:
         print("No valid strips processed")
         return
 
     # Сохранение с максимальным качеством
-    result = combine_strips(strips)
     cv2.imwrite(output_path, result,
                 [int(cv2.IMWRITE_JPEG_QUALITY), 100,  # Максимальное качество
                  int(cv2.IMWRITE_JPEG_OPTIMIZE), 1])
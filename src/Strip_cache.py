@@ -0,0 +1,270 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+# Предельный размер кэша на диске и доля предела, до которой кэш очищается при превышении
+CACHE_MAX_BYTES = 2 * 1024 ** 3
+CACHE_LOW_WATER = 0.9
+
+# Предельный размер кэша декодированных областей в памяти и на диске (при spill_dir)
+REGION_CACHE_MAX_BYTES = 1024 ** 3
+REGION_SPILL_MAX_BYTES = 32 * 1024 ** 3
+
+
+class StripCache:
+    """
+    Дисковый кэш обработанных фрагментов кадров.
+    Ключ - путь, размер и время изменения файла (или хэш содержимого) вместе
+    с параметрами фильтрации и обрезки. Порядок использования записей и их
+    размеры хранятся в памяти (начальный порядок - по времени изменения файлов);
+    при превышении предела удаляются давно не использованные записи, пока кэш
+    не сократится до доли CACHE_LOW_WATER от предела.
+    """
+
+    def __init__(self, cache_dir, max_bytes=CACHE_MAX_BYTES, use_hash=False):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.use_hash = use_hash
+        self.lock = threading.Lock()
+
+        # Индекс LRU: ключ -> размер записи, от давно не использованных к недавним
+        entries = []
+        for entry in self.cache_dir.glob('*.npy'):
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime_ns, entry.stem, stat.st_size))
+        entries.sort()
+        self.entries = OrderedDict((key, size) for _, key, size in entries)
+        self.total_bytes = sum(self.entries.values())
+
+    def key(self, img_path, params):
+        """Ключ записи для кадра и набора параметров"""
+        img_path = Path(img_path)
+        stat = img_path.stat()
+        if self.use_hash:
+            version = hashlib.sha1(img_path.read_bytes()).hexdigest()
+        else:
+            version = stat.st_mtime_ns
+        raw = repr((str(img_path.resolve()), stat.st_size, version, tuple(params)))
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        entry = self.cache_dir / f"{key}.npy"
+        try:
+            strip = np.load(entry)
+        except (OSError, ValueError):
+            return None
+
+        # Отметка об использовании для вытеснения LRU (время файла - для следующих запусков)
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+        try:
+            os.utime(entry)
+        except OSError:
+            pass
+        return strip
+
+    def put(self, key, strip):
+        entry = self.cache_dir / f"{key}.npy"
+        tmp = self.cache_dir / f"{key}.{threading.get_ident()}.tmp"
+        with open(tmp, 'wb') as f:
+            np.save(f, np.ascontiguousarray(strip))
+        os.replace(tmp, entry)
+        size = entry.stat().st_size
+
+        with self.lock:
+            # Перезапись ключа заменяет прежний размер записи, а не добавляется к нему
+            self.total_bytes += size - self.entries.pop(key, 0)
+            self.entries[key] = size
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """Удаление давно не использованных записей до доли CACHE_LOW_WATER от предела"""
+        low_water = self.max_bytes * CACHE_LOW_WATER
+        while self.entries and self.total_bytes > low_water:
+            key, size = self.entries.popitem(last=False)
+            try:
+                (self.cache_dir / f"{key}.npy").unlink()
+            except FileNotFoundError:
+                pass
+            except OSError:
+                # Файл занят: запись остаётся в кэше как недавно использованная
+                self.entries[key] = size
+                break
+            self.total_bytes -= size
+
+    def cached(self, process, params):
+        """Обёртка над функцией обработки кадра: сначала кэш, затем process"""
+        def process_cached(img_path, *data):
+            try:
+                key = self.key(img_path, params)
+            except OSError:
+                return process(img_path, *data)
+
+            strip = self.get(key)
+            if strip is None:
+                strip = process(img_path, *data)
+                if strip is not None:
+                    self.put(key, strip)
+            return strip
+
+        return process_cached
+
+    def cached_read(self, read, params):
+        """Обёртка над чтением кадра для конвейера: кадры, уже лежащие в кэше, не читаются"""
+        def read_uncached(img_path):
+            try:
+                if (self.cache_dir / f"{self.key(img_path, params)}.npy").exists():
+                    return None
+            except OSError:
+                pass
+            return read(img_path)
+
+        return read_uncached
+
+
+class RegionCache:
+    """
+    Ограниченный кэш декодированных центральных областей кадров.
+    Область покрывает любой фрагмент до max_crop_width x max_crop_height вместе
+    с запасом max_halo под ядра фильтров, поэтому при смене параметров
+    фильтрации и обрезки кадры не декодируются заново. Записи хранятся в
+    памяти или, если задан spill_dir, в .npy на диске и открываются как np.memmap
+    (тогда предел max_bytes по умолчанию - REGION_SPILL_MAX_BYTES на диске).
+
+    Кадры перебираются подряд при каждом запуске, поэтому заполненный кэш
+    новые области не принимает (вытеснение LRU при таком переборе не даёт
+    ни одного попадания): первые кадры, что поместились, остаются в кэше.
+    Записи кадров, которых больше нет в списке (retain) или которые изменились,
+    удаляются вместе с их файлами на диске.
+    """
+
+    def __init__(self, max_crop_width, max_crop_height, max_halo, max_bytes=None, spill_dir=None):
+        self.max_crop_width = max_crop_width
+        self.max_crop_height = max_crop_height
+        self.max_halo = max_halo
+        self.spill_dir = Path(spill_dir) if spill_dir else None
+        if max_bytes is None:
+            max_bytes = REGION_SPILL_MAX_BYTES if self.spill_dir else REGION_CACHE_MAX_BYTES
+        self.max_bytes = max_bytes
+        if self.spill_dir:
+            self.spill_dir.mkdir(parents=True, exist_ok=True)
+            # Записи не переживают процесс: файлы прошлых запусков не нужны
+            for entry in self.spill_dir.glob('*.npy'):
+                self._unlink(entry)
+        self.lock = threading.Lock()
+        self.entries = {}  # путь -> (ключ с размером и временем изменения, область)
+        self.total_bytes = 0
+
+    def covers(self, crop_width, crop_height, halo):
+        """Помещается ли фрагмент с такими параметрами в кэшируемую область"""
+        return (crop_width <= self.max_crop_width and crop_height <= self.max_crop_height
+                and halo <= self.max_halo)
+
+    def region_bounds(self, shape):
+        """Границы кэшируемой области кадра (y_start, y_end, x_start, x_end)"""
+        h, w = shape[:2]
+        y_start = max(0, (h - self.max_crop_height) // 2 - self.max_halo)
+        x_start = max(0, (w - self.max_crop_width) // 2 - self.max_halo)
+        y_end = min(h, max(0, (h - self.max_crop_height) // 2) + self.max_crop_height + self.max_halo)
+        x_end = min(w, max(0, (w - self.max_crop_width) // 2) + self.max_crop_width + self.max_halo)
+        return y_start, y_end, x_start, x_end
+
+    def entry_key(self, img_path):
+        img_path = Path(img_path)
+        stat = img_path.stat()
+        return (str(img_path), stat.st_size, stat.st_mtime_ns)
+
+    def __contains__(self, img_path):
+        try:
+            key = self.entry_key(img_path)
+        except OSError:
+            return False
+        with self.lock:
+            entry = self.entries.get(key[0])
+            return entry is not None and entry[0] == key
+
+    @staticmethod
+    def _unlink(path):
+        try:
+            path.unlink()
+        except OSError:
+            pass
+
+    def _drop(self, path):
+        """Удаление записи кадра (вызывается под self.lock)"""
+        _, (pixels, _, _) = self.entries.pop(path)
+        self.total_bytes -= pixels.nbytes
+        if isinstance(pixels, np.memmap):
+            self._unlink(Path(pixels.filename))
+
+    def retain(self, image_files):
+        """Удаление записей кадров, которых нет в image_files (например, выбрана другая папка)"""
+        keep = {str(Path(img_path)) for img_path in image_files}
+        with self.lock:
+            for path in [path for path in self.entries if path not in keep]:
+                self._drop(path)
+
+    def get(self, img_path, data=None):
+        """
+        (область, origin, размер кадра) из кэша или после декодирования кадра
+        (data - заранее прочитанные байты файла)
+        """
+        key = self.entry_key(img_path)
+
+        with self.lock:
+            entry = self.entries.get(key[0])
+            if entry is not None:
+                if entry[0] == key:
+                    return entry[1]
+                # Файл кадра изменился
+                self._drop(key[0])
+
+        if data is None:
+            img = cv2.imread(str(img_path))
+        else:
+            img = cv2.imdecode(data, cv2.IMREAD_COLOR)
+        if img is None:
+            return None
+
+        y_start, y_end, x_start, x_end = self.region_bounds(img.shape)
+        pixels = np.ascontiguousarray(img[y_start:y_end, x_start:x_end])
+        region = (pixels, (y_start, x_start), img.shape)
+
+        # Место резервируется до записи на диск; заполненный кэш новые области не принимает
+        with self.lock:
+            if key[0] in self.entries or self.total_bytes + pixels.nbytes > self.max_bytes:
+                return region
+            self.total_bytes += pixels.nbytes
+            self.entries[key[0]] = (key, region)
+
+        if self.spill_dir:
+            entry = self.spill_dir / f"{hashlib.sha1(repr(key).encode('utf-8')).hexdigest()}.npy"
+            try:
+                np.save(entry, pixels)
+                spilled = (np.load(entry, mmap_mode='r'), (y_start, x_start), img.shape)
+            except OSError:
+                # Нет места на диске - область не кэшируется
+                with self.lock:
+                    if self.entries.get(key[0], (None,))[0] == key:
+                        self.entries.pop(key[0])
+                        self.total_bytes -= pixels.nbytes
+                self._unlink(entry)
+                return region
+            with self.lock:
+                if self.entries.get(key[0], (None,))[0] == key:
+                    self.entries[key[0]] = (key, spilled)
+                    return region
+            # Запись успели удалить (retain или изменение кадра)
+            self._unlink(entry)
+        return region
@@ -1,12 +1,26 @@
+import os
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
 import cv2
 import numpy as np
 from pathlib import Path
 
-from src.Grey_fade import grey_scale
+from src.Grey_fade import convert_to_grayscale
 from src.Wavelegth_calc import graphscalc
 from src.detector import detect
+from src.Strip_cache import StripCache, RegionCache
+from src.Frame_index import indexed_frames, capture_times, indexed_quality, store_quality
+from src.Frame_quality import screen_frame, mark_duplicates, write_report
+from src.Job_config import default_config
+from src.Keogram_store import KeogramStore
 
 # ========== ГЛОБАЛЬНЫЕ НАСТРОЙКИ ==========
+# Значения по умолчанию для default_config(); функции обработки получают
+# настройки задания через config (JobConfig) и сами глобальные переменные не читают
 INPUT_DIR = "E:\CMU\Code\Sky_samples"  # Папка с исходными изображениями
 OUTPUT_PATH = "E:\CMU\Code\Samples_res\output_test.jpg"  # Путь для сохранения результата
 
@@ -20,6 +34,52 @@ BILATERAL_SIGMA_SPACE = 10  # Стандартное отклонение в к
 CROP_WIDTH = 30  # Ширина вырезаемого фрагмента (X)
 CROP_HEIGHT = 2000  # Высота вырезаемого фрагмента (Y)
 
+# Фильтровать только фрагмент с запасом под ядра фильтров, а не весь кадр
+CROP_FIRST = True
+
+# Число потоков обработки кадров (OpenCV освобождает GIL при декодировании и фильтрации)
+WORKERS = os.cpu_count() or 1
+
+# Конвейер чтения: потоки предварительного чтения файлов и глубина очередей
+# (прочитанные, но не декодированные кадры и готовые, но не записанные полосы)
+PREFETCH_READERS = 4
+READ_AHEAD = 16
+RESULT_QUEUE = 32
+
+# Файл .npy для сборки кеограммы на диске через np.memmap (None - сборка в памяти)
+KEOGRAM_MEMMAP = None
+
+# Папка хранилища кеограммы без потерь (.keogram) с временем съёмки и именем кадра
+# каждого столбца; при заданном хранилище JPEG не пишется - экспорт отдельным шагом
+# (Keogram_store.export_keogram). None - кеограмма сохраняется в OUTPUT_PATH
+KEOGRAM_STORE = None
+
+# Кэш обработанных фрагментов: повторный запуск обрабатывает только новые кадры
+USE_CACHE = True
+CACHE_DIR = None  # None - папка .keogram_cache внутри INPUT_DIR
+
+# Индекс кадров (SQLite) и интервал времени съёмки для кеограммы, например
+# TIME_START = "2026-10-17 22:00", TIME_END = "2026-10-18 02:00" (None - без ограничения)
+USE_FRAME_INDEX = True
+FRAME_INDEX_PATH = None  # None - файл .frames.sqlite внутри папки с кадрами
+REFRESH_INDEX = False  # Полный обход папки (например, если кадры перезаписывались на месте)
+TIME_START = None
+TIME_END = None
+
+# Предварительная отбраковка чёрных, пересвеченных и повторяющихся кадров;
+# вместо отброшенного кадра в кеограмму пишется чёрный столбец
+QUALITY_SCREEN = True
+
+# Быстрый просмотр: JPEG декодируется сразу в 1/2, 1/4 или 1/8 разрешения
+# (DCT-масштабирование), параметры фильтров и обрезки пересчитываются (1 - полное)
+QUICK_LOOK = 1
+REDUCED_READ_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
 
 # ==========================================
 
@@ -30,90 +90,593 @@ def get_image_files(directory):
             if f.is_file() and f.suffix.lower() in image_extensions]
 
 
-def reduce_jpeg_artifacts(img):
+def select_frames(directory, start=None, end=None, config=None):
+    """Кадры папки в порядке времени съёмки (через индекс) или в порядке обхода папки"""
+    config = config or default_config()
+    if config.use_frame_index:
+        return indexed_frames(directory, start, end, config.frame_index_path, config.refresh_index)
+    return get_image_files(directory)
+
+
+def reduce_jpeg_artifacts(img, config=None):
     """Уменьшение артефактов JPEG"""
-    filtered = cv2.medianBlur(img, MEDIAN_BLUR_SIZE)
+    config = config or default_config()
+    filtered = cv2.medianBlur(img, config.median_blur_size)
     return cv2.bilateralFilter(filtered,
-                               d=BILATERAL_D,
-                               sigmaColor=BILATERAL_SIGMA_COLOR,
-                               sigmaSpace=BILATERAL_SIGMA_SPACE)
+                               d=config.bilateral_d,
+                               sigmaColor=config.bilateral_sigma_color,
+                               sigmaSpace=config.bilateral_sigma_space)
 
 
-def extract_center_crop(img):
+def extract_center_crop(img, config=None):
     """Вырезание центрального фрагмента"""
+    config = config or default_config()
     h, w = img.shape[:2]
-    y_start = max(0, (h - CROP_HEIGHT) // 2)
-    x_start = max(0, (w - CROP_WIDTH) // 2)
+    y_start = max(0, (h - config.crop_height) // 2)
+    x_start = max(0, (w - config.crop_width) // 2)
 
-    return img[y_start:y_start + CROP_HEIGHT,
-           x_start:x_start + CROP_WIDTH]
+    return img[y_start:y_start + config.crop_height,
+           x_start:x_start + config.crop_width]
 
 
-def process_image(img_path):
-    """Обработка одного изображения"""
-    try:
+def crop_bounds(shape, crop_width, crop_height):
+    """Границы центрального фрагмента (y_start, y_end, x_start, x_end)"""
+    h, w = shape[:2]
+    y_start = max(0, (h - crop_height) // 2)
+    x_start = max(0, (w - crop_width) // 2)
+    return y_start, min(h, y_start + crop_height), x_start, min(w, x_start + crop_width)
+
+
+def filter_halo(median_size, bilateral_d, sigma_space):
+    """Запас в пикселях вокруг фрагмента, который нужен ядрам фильтров"""
+    # Радиус билатерального фильтра считается так же, как в OpenCV
+    if bilateral_d > 0:
+        bilateral_radius = bilateral_d // 2
+    else:
+        bilateral_radius = int(round(sigma_space * 1.5))
+    return median_size // 2 + max(bilateral_radius, 1)
+
+
+def filter_center_crop(img, median_size, bilateral_d, sigma_color, sigma_space,
+                       crop_width, crop_height, origin=(0, 0), full_shape=None):
+    """
+    Фильтрация только центрального фрагмента вместе с запасом под ядра фильтров.
+    Внутри фрагмента пиксели совпадают с фильтрацией всего кадра.
+    img может быть уже вырезанной областью кадра размера full_shape,
+    начинающейся в точке origin (y, x).
+    """
+    full_shape = full_shape or img.shape
+    h, w = full_shape[:2]
+    y_start, y_end, x_start, x_end = crop_bounds(full_shape, crop_width, crop_height)
+    halo = filter_halo(median_size, bilateral_d, sigma_space)
+
+    # Окно обрезается по краям кадра, поэтому граничные условия фильтров не меняются
+    win_y, win_x = max(0, y_start - halo), max(0, x_start - halo)
+    win_y_end, win_x_end = min(h, y_end + halo), min(w, x_end + halo)
+
+    origin_y, origin_x = origin
+    if (win_y < origin_y or win_x < origin_x or
+            win_y_end > origin_y + img.shape[0] or win_x_end > origin_x + img.shape[1]):
+        raise ValueError("Фрагмент с запасом выходит за пределы декодированной области")
+
+    window = np.ascontiguousarray(img[win_y - origin_y:win_y_end - origin_y,
+                                      win_x - origin_x:win_x_end - origin_x])
+
+    filtered = cv2.medianBlur(window, median_size)
+    filtered = cv2.bilateralFilter(filtered,
+                                   d=bilateral_d,
+                                   sigmaColor=sigma_color,
+                                   sigmaSpace=sigma_space)
+
+    return filtered[y_start - win_y:y_end - win_y,
+                    x_start - win_x:x_end - win_x]
+
+
+def scale_params(params, factor):
+    """Параметры фильтров и обрезки для кадра, уменьшенного в factor раз"""
+    if factor == 1:
+        return tuple(params)
+
+    median_size, bilateral_d, sigma_color, sigma_space, crop_width, crop_height = params
+    median_size = max(1, int(round(median_size / factor)) | 1)  # Размер ядра остаётся нечётным
+    if bilateral_d > 0:
+        bilateral_d = max(1, int(round(bilateral_d / factor)))
+    # Сигма цвета относится к яркости и от масштаба не зависит
+    return (median_size, bilateral_d, sigma_color, sigma_space / factor,
+            max(1, int(round(crop_width / factor))), max(1, int(round(crop_height / factor))))
+
+
+def read_frame(img_path, factor=1):
+    """Чтение кадра, при factor > 1 - сразу в уменьшенном разрешении"""
+    return cv2.imread(str(img_path), REDUCED_READ_FLAGS[factor])
+
+
+def read_frame_bytes(img_path):
+    """Чтение файла кадра целиком, без декодирования (стадия чтения конвейера)"""
+    return np.fromfile(str(img_path), dtype=np.uint8)
+
+
+def decode_frame(data, factor=1):
+    """Декодирование прочитанного файла кадра, при factor > 1 - в уменьшенном разрешении"""
+    return cv2.imdecode(data, REDUCED_READ_FLAGS[factor])
+
+
+def filter_frame(img, config=None):
+    """Фильтрация кадра и вырезание центрального фрагмента"""
+    config = config or default_config()
+    if config.crop_first or config.quick_look != 1:
+        return filter_center_crop(img, *filter_params(config))
+    return extract_center_crop(reduce_jpeg_artifacts(img, config), config)
+
+
+def check_crop_first(image_files, limit=5, config=None):
+    """
+    Сравнение режима crop-first с фильтрацией всего кадра на первых limit кадрах:
+    для текущих настроек, для билатерального фильтра с d <= 0 (радиус по
+    sigma_space) и для фрагмента во всю ширину кадра.
+    """
+    config = (config or default_config()).replace(quick_look=1)
+    for img_path in image_files[:limit]:
         img = cv2.imread(str(img_path))
         if img is None:
-            print(f"Ошибка загрузки: {img_path.name}")
-            return None
+            continue
 
-        # Предобработка изображения
-        processed = reduce_jpeg_artifacts(img)
+        for variant in (config, config.replace(bilateral_d=0), config.replace(crop_width=img.shape[1])):
+            reference = extract_center_crop(reduce_jpeg_artifacts(img, variant), variant)
+            fast = filter_center_crop(img, *filter_params(variant))
+            if not np.array_equal(reference, fast):
+                print(f"Расхождение crop-first и полного кадра: {img_path.name} "
+                      f"(d={variant.bilateral_d}, ширина {variant.crop_width})")
+                return False
 
-        # Вырезание центрального фрагмента
-        cropped = extract_center_crop(processed)
+    return True
 
-        return cropped
+
+def process_image(img_path, data=None, config=None):
+    """Обработка одного изображения (data - заранее прочитанные байты файла)"""
+    try:
+        config = config or default_config()
+        if data is None:
+            img = read_frame(img_path, config.quick_look)
+        else:
+            img = decode_frame(data, config.quick_look)
+        if img is None:
+            print(f"Ошибка загрузки: {img_path.name}")
+            return None
+
+        # Фильтрация и вырезание центрального фрагмента
+        return filter_frame(img, config)
 
     except Exception as e:
         print(f"Ошибка обработки {img_path.name}: {str(e)}")
         return None
 
 
+def process_images_parallel(image_files, process=None, workers=None, read=None, config=None):
+    """
+    Параллельная обработка кадров в пуле потоков.
+    Возвращает пары (путь, результат) строго в исходном порядке кадров.
+    Если задана функция чтения read, работает конвейер process_images_pipelined
+    (глубина очередей - из config).
+    """
+    process = process or process_image
+    workers = max(1, workers or WORKERS)
+    if read is not None:
+        depths = ()
+        if config is not None:
+            depths = (config.prefetch_readers, config.read_ahead, config.result_queue)
+        yield from process_images_pipelined(image_files, process, read, workers, *depths)
+        return
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # Ограничиваем число кадров в работе, чтобы не держать в памяти всю ночь
+        pending = deque()
+        for img_path in image_files:
+            pending.append((img_path, executor.submit(process, img_path)))
+            if len(pending) >= workers * 4:
+                path, future = pending.popleft()
+                yield path, future.result()
+
+        while pending:
+            path, future = pending.popleft()
+            yield path, future.result()
+
+
+def process_images_pipelined(image_files, process=None, read=None, workers=None,
+                             readers=None, read_ahead=None, queue_depth=None):
+    """
+    Конвейер обработки кадров с ограниченными очередями:
+    потоки чтения заранее читают файлы (read(путь) -> данные, не более read_ahead
+    кадров вперёд), потоки обработки декодируют и фильтруют (process(путь, данные)),
+    а вызывающий код получает пары (путь, результат) в исходном порядке кадров.
+    Чтение с медленного диска перекрывается с декодированием и записью.
+    read может вернуть None - тогда process читает кадр сам (например, кадр уже в кэше).
+    Кадр, который не удалось прочитать, пропускается: результат None.
+    Одновременно в конвейере (от начала чтения до выдачи) не больше
+    read_ahead + queue_depth кадров, даже если один кадр читается долго.
+    """
+    process = process or process_image
+    read = read or read_frame_bytes
+    workers = max(1, workers or WORKERS)
+    readers = max(1, readers or PREFETCH_READERS)
+    read_ahead = max(1, read_ahead or READ_AHEAD)
+    queue_depth = max(1, queue_depth or RESULT_QUEUE)
+    read_queue = queue.Queue(maxsize=read_ahead)
+    result_queue = queue.Queue(maxsize=queue_depth)
+    in_flight = threading.Semaphore(read_ahead + queue_depth)
+    stop = threading.Event()
+    frames = iter(enumerate(image_files))
+    frames_lock = threading.Lock()
+
+    def put(target, item):
+        # Ожидание места в очереди с проверкой остановки конвейера
+        while not stop.is_set():
+            try:
+                target.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def read_stage():
+        while not stop.is_set():
+            # Место в конвейере освобождается, когда кадр выдан по порядку
+            if not in_flight.acquire(timeout=0.1):
+                continue
+            with frames_lock:
+                item = next(frames, None)
+            if item is None:
+                in_flight.release()
+                return
+            i, img_path = item
+            try:
+                data, error = read(img_path), None
+            except Exception as e:
+                print(f"Ошибка загрузки: {img_path.name} ({e})")
+                data, error = None, e
+            if not put(read_queue, (i, img_path, data, error)):
+                return
+
+    def process_stage():
+        while True:
+            item = read_queue.get()
+            if item is None:
+                put(result_queue, None)
+                return
+            i, img_path, data, read_error = item
+            result, error = None, None
+            if read_error is None:
+                try:
+                    result = process(img_path, data)
+                except Exception as e:
+                    error = e
+            if not put(result_queue, (i, img_path, result, error)):
+                return
+
+    def close_read_stage():
+        # Когда все файлы прочитаны, потоки обработки получают признак конца
+        for thread in reader_threads:
+            thread.join()
+        for _ in range(workers):
+            put(read_queue, None)
+
+    reader_threads = [threading.Thread(target=read_stage, daemon=True) for _ in range(readers)]
+    worker_threads = [threading.Thread(target=process_stage, daemon=True) for _ in range(workers)]
+    for thread in reader_threads + worker_threads:
+        thread.start()
+    threading.Thread(target=close_read_stage, daemon=True).start()
+
+    # Результаты приходят не по порядку: ждём следующий по номеру кадр.
+    # Буфер ограничен семафором in_flight: кадры дальше read_ahead + queue_depth
+    # от ещё не выданного не начинают читаться
+    pending = {}
+    next_index = 0
+    finished = 0
+    try:
+        while finished < workers:
+            item = result_queue.get()
+            if item is None:
+                finished += 1
+                continue
+            pending[item[0]] = item[1:]
+            while next_index in pending:
+                img_path, result, error = pending.pop(next_index)
+                if error is not None:
+                    raise error
+                yield img_path, result
+                next_index += 1
+                in_flight.release()
+    finally:
+        stop.set()
+        # Освобождаем потоки обработки, ожидающие прочитанные кадры
+        for _ in range(workers):
+            try:
+                read_queue.put_nowait(None)
+            except queue.Full:
+                break
+
+
+class KeogramWriter:
+    """
+    Потоковая сборка кеограммы: каждая полоса сразу пишется в заранее выделенный
+    массив (или np.memmap на диске), без списка полос и итогового np.hstack.
+    При growable=True буфер в памяти расширяется, если кадров больше ожидаемого.
+    """
+
+    def __init__(self, frame_count, strip_width, memmap_path=None, growable=False):
+        self.frame_count = frame_count
+        self.strip_width = strip_width
+        self.memmap_path = memmap_path
+        self.growable = growable and memmap_path is None
+        self.buffer = None
+        self.height = 0
+        self.width = 0
+
+    def _allocate(self, strip):
+        # Высота первой полосы - верхняя граница итоговой (минимальной) высоты
+        shape = (strip.shape[0], self.frame_count * self.strip_width) + strip.shape[2:]
+        if self.memmap_path is not None:
+            self.buffer = np.lib.format.open_memmap(str(self.memmap_path), mode='w+',
+                                                    dtype=strip.dtype, shape=shape)
+        else:
+            self.buffer = np.empty(shape, dtype=strip.dtype)
+        self.height = strip.shape[0]
+
+    def _grow(self, min_width):
+        # Удвоение ёмкости: копирование амортизируется на все добавления
+        shape = (self.buffer.shape[0], max(min_width, 2 * self.buffer.shape[1])) + self.buffer.shape[2:]
+        buffer = np.empty(shape, dtype=self.buffer.dtype)
+        buffer[:self.height, :self.width] = self.buffer[:self.height, :self.width]
+        self.buffer = buffer
+
+    def append(self, strip):
+        """Запись очередной полосы справа от уже собранных"""
+        if self.buffer is None:
+            self._allocate(strip)
+
+        strip_width = strip.shape[1]
+        if self.width + strip_width > self.buffer.shape[1]:
+            if not self.growable:
+                raise ValueError("Полоса не помещается в выделенную кеограмму")
+            self._grow(self.width + strip_width)
+
+        # Итоговая высота - минимальная среди полос, как в combine_images
+        self.height = min(self.height, strip.shape[0])
+        self.buffer[:self.height, self.width:self.width + strip_width] = strip[:self.height]
+        self.width += strip_width
+
+    def result(self):
+        """Собранная кеограмма (представление буфера без копирования)"""
+        if self.buffer is None or self.width == 0:
+            return None
+        return self.buffer[:self.height, :self.width]
+
+
 def combine_images(images):
     """Склейка изображений в одну полосу"""
     if not images:
         return None
 
-    # Определение минимальной высоты
-    min_height = min(img.shape[0] for img in images)
+    writer = KeogramWriter(len(images), max(img.shape[1] for img in images))
+    for img in images:
+        writer.append(img)
+
+    return writer.result()
+
+
+def filter_params(config=None):
+    """Действующие параметры фильтрации и обрезки (с учётом быстрого просмотра)"""
+    config = config or default_config()
+    return scale_params((config.median_blur_size, config.bilateral_d, config.bilateral_sigma_color,
+                         config.bilateral_sigma_space, config.crop_width, config.crop_height),
+                        config.quick_look)
+
+
+def cache_params(config=None):
+    """Параметры, от которых зависит обработанный фрагмент (часть ключа кэша)"""
+    config = config or default_config()
+    return filter_params(config) + (config.quick_look,)
+
+
+def frame_cache(input_dir=None, config=None):
+    """Кэш обработанных фрагментов или None, если кэш отключён"""
+    config = config or default_config()
+    if not config.use_cache:
+        return None
+    return StripCache(config.cache_dir or Path(input_dir or config.input_dir) / ".keogram_cache")
+
+
+def screen_frames(image_files, workers=None, config=None):
+    """
+    Оценка качества всех кадров (параллельно) с отметкой повторов в порядке кадров.
+    С индексом кадров оценки хранятся в нём: заново читаются только новые
+    и изменённые кадры.
+    """
+    config = config or default_config()
+    known = indexed_quality(image_files, config.frame_index_path) if config.use_frame_index else {}
+    todo = [img_path for img_path in image_files if img_path not in known]
+    screened = dict(process_images_parallel(todo, screen_frame, workers))
+
+    # Нечитаемый кадр мог быть временно занят - его оценка не сохраняется
+    if config.use_frame_index:
+        store_quality([row for row in screened.values() if row['status'] != 'unreadable'],
+                      config.frame_index_path)
+    return mark_duplicates([known.get(img_path) or screened[img_path] for img_path in image_files])
+
+
+def placeholder_strip(row, config=None):
+    """Чёрный столбец размера фрагмента, чтобы отброшенный кадр сохранял место во времени"""
+    config = config or default_config()
+    # Размер кадра после уменьшенного декодирования округляется вверх
+    height, width = -(-row['height'] // config.quick_look), -(-row['width'] // config.quick_look)
+    crop_width, crop_height = filter_params(config)[4:]
+    y_start, y_end, x_start, x_end = crop_bounds((height, width), crop_width, crop_height)
+    return np.zeros((y_end - y_start, x_end - x_start, 3), dtype=np.uint8)
+
+
+def skip_rejected(process, rejected, config=None):
+    """Обёртка над обработкой кадра: отброшенные кадры заменяются заглушкой без декодирования"""
+    def process_screened(img_path, *data):
+        row = rejected.get(img_path)
+        if row is None:
+            return process(img_path, *data)
+        if row['status'] == 'unreadable':
+            return None
+        return placeholder_strip(row, config)
+
+    return process_screened
+
+
+def skip_rejected_read(read, rejected):
+    """Обёртка над чтением кадра: отброшенные кадры не читаются"""
+    def read_screened(img_path):
+        if img_path in rejected:
+            return None
+        return read(img_path)
+
+    return read_screened
+
+
+def build_keogram(image_files, progress_callback=None, config=None):
+    """
+    Сборка кеограммы из кадров в памяти, без записи на диск, или, если задано
+    config.keogram_store, в хранилище (результат - представление np.memmap)
+    """
+    config = config or default_config()
+    process = partial(process_image, config=config)
+    read = read_frame_bytes
+    cache = frame_cache(config=config)
+    if cache is not None:
+        process = cache.cached(process, cache_params(config))
+        read = cache.cached_read(read, cache_params(config))
+
+    if config.quality_screen:
+        rows = screen_frames(image_files, config.workers, config)
+        output_path = Path(config.output_path)
+        write_report(rows, output_path.with_name(f"{output_path.stem}_quality.csv"))
+        rejected = {row['path']: row for row in rows if row['status'] != 'ok'}
+        process = skip_rejected(process, rejected, config)
+        read = skip_rejected_read(read, rejected)
+
+    if config.keogram_store:
+        writer = KeogramStore.create(config.keogram_store)
+        times = capture_times(image_files, config.frame_index_path)
+    else:
+        writer = KeogramWriter(len(image_files), filter_params(config)[4], config.keogram_memmap)
+
+    frames = process_images_parallel(image_files, process, config.workers, read, config)
+    for i, (img_path, cropped) in enumerate(frames, 1):
+        if cropped is not None:
+            if config.keogram_store:
+                writer.append(cropped, img_path.name, times[img_path])
+            else:
+                writer.append(cropped)
+            print(f"Обработано: {img_path.name}")
+        if progress_callback:
+            progress_callback(i)
+
+    return writer.pixels if config.keogram_store else writer.result()
+
+
+def sweep_keograms(image_files, param_sets, region_cache=None, workers=None):
+    """
+    Кеограммы для нескольких наборов параметров за один проход по кадрам.
+    Набор параметров - кортеж в порядке filter_params(). Каждый кадр декодируется
+    один раз (или берётся из region_cache), дальше только фильтрация.
+    """
+    param_sets = [tuple(params) for params in param_sets]
+    if region_cache is None:
+        region_cache = RegionCache(max(params[4] for params in param_sets),
+                                   max(params[5] for params in param_sets),
+                                   max(filter_halo(params[0], params[1], params[3]) for params in param_sets))
+
+    def process(img_path):
+        region = region_cache.get(img_path)
+        if region is None:
+            return None
+        pixels, origin, full_shape = region
+        return [filter_center_crop(pixels, *params, origin=origin, full_shape=full_shape)
+                for params in param_sets]
+
+    writers = [KeogramWriter(len(image_files), params[4]) for params in param_sets]
+    for img_path, strips in process_images_parallel(image_files, process, workers):
+        if strips is None:
+            continue
+        for writer, strip in zip(writers, strips):
+            writer.append(strip)
 
-    # Обрезка изображений до одинаковой высоты
-    cropped = [img[:min_height] for img in images]
+    return [writer.result() for writer in writers]
 
-    return np.hstack(cropped)
 
+def main(config=None):
+    config = config or default_config()
 
-def main():
     # Получение списка изображений
-    image_files = get_image_files(INPUT_DIR)
+    image_files = select_frames(config.input_dir, config.time_start, config.time_end, config)
     if not image_files:
-        print(f"В директории {INPUT_DIR} не найдено изображений")
-        return
+        print(f"В директории {config.input_dir} не найдено изображений")
+        return None
 
     print(f"Найдено изображений: {len(image_files)}")
 
-    # Обработка всех изображений
-    processed_images = []
-    for img_path in image_files:
-        cropped = process_image(img_path)
-        if cropped is not None:
-            processed_images.append(cropped)
-            print(f"Обработано: {img_path.name}")
+    # Обработка всех изображений с записью полос сразу в кеограмму
+    combined = build_keogram(image_files, config=config)
 
-    # Склейка и сохранение результата
-    if processed_images:
-        combined = combine_images(processed_images)
-        if combined is not None:
-            cv2.imwrite(OUTPUT_PATH, combined)
-            print(f"\nРезультат сохранён в: {OUTPUT_PATH}")
-            print(f"Финальный размер: {combined.shape[1]}x{combined.shape[0]}")
+    # Сохранение результата (хранилище уже записано при сборке)
+    if combined is not None:
+        if not config.keogram_store:
+            cv2.imwrite(str(config.output_path), combined)
+        print(f"\nРезультат сохранён в: {config.keogram_store or config.output_path}")
+        print(f"Финальный размер: {combined.shape[1]}x{combined.shape[0]}")
     else:
         print("Не удалось обработать ни одного изображения")
 
+    return combined
+
+
+def run_pipeline(save_intermediate=False, config=None):
+    """
+    Кеограмма -> оттенки серого -> поиск ярких областей в памяти.
+    Промежуточные JPEG не пишутся и не читаются заново; на диск попадают
+    только итоговые результаты (и полутоновая кеограмма при save_intermediate).
+    """
+    config = config or default_config()
+    combined = main(config)
+    if combined is None:
+        return None
+
+    if config.keogram_store:
+        # Полутоновая плоскость хранилища читается без копирования и пересчёта
+        name = f"{Path(config.keogram_store).stem}.png"
+        gray = KeogramStore(config.keogram_store).gray
+    else:
+        name = Path(config.output_path).name
+        gray = convert_to_grayscale(combined)
+    if save_intermediate:
+        gray_dir = Path(config.gray_output_dir)
+        gray_dir.mkdir(parents=True, exist_ok=True)
+        cv2.imwrite(str(gray_dir / name), gray)
+
+    detect(images=[(name, gray)], config=config)
+    return gray
+
 
 if __name__ == "__main__":
-    main()
-    grey_scale()
-    detect()
-    graphscalc()
\ No newline at end of file
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Построение кеограммы и поиск ярких областей")
+    parser.add_argument('--quick-look', type=int, choices=sorted(REDUCED_READ_FLAGS), default=QUICK_LOOK,
+                        help="уменьшение разрешения при декодировании для быстрого просмотра")
+    parser.add_argument('--check-crop-first', type=int, nargs='?', const=5, default=None, metavar='N',
+                        help="сравнить crop-first с фильтрацией всего кадра на первых N кадрах и выйти")
+    args = parser.parse_args()
+
+    if args.check_crop_first is not None:
+        config = default_config()
+        frames = select_frames(config.input_dir, config.time_start, config.time_end, config)
+        ok = check_crop_first(frames, args.check_crop_first, config)
+        print("crop-first совпадает с фильтрацией всего кадра" if ok else "crop-first расходится")
+        raise SystemExit(0 if ok else 1)
+
+    run_pipeline(config=default_config(quick_look=args.quick_look))
+    graphscalc()
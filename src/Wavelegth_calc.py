@@ -4,8 +4,12 @@ import matplotlib.pyplot as plt
 import os
 import glob
 
+from src.Job_config import default_config
+from src.Keogram_store import KeogramStore, is_store
+
 # Глобальные переменные для настройки
 STRIPE_WIDTH = 30  # Ширина полоски в пикселях
+STRIPE_BLOCK_PIXELS = 1 << 24  # Пикселей в блоке полосок при поиске пиков (ограничивает память)
 INPUT_PATH = 'E:\CMU\Code\Samples_res\output_test.jpg'  # Путь к изображениям
 OUTPUT_DIR = 'E:\CMU\Code\Graphics'  # Папка для сохранения графиков
 
@@ -14,56 +18,159 @@ def rgb_to_wavelength(rgb):
     """
     Улучшенное преобразование RGB в длину волны.
     Учитывает соотношение каналов и физические пределы.
+    Принимает один пиксель (3,) или массив пикселей (..., 3) и считает
+    все пиксели за один проход NumPy.
     """
-    r, g, b = rgb.astype(float) / 255.0
+    channels = np.asarray(rgb).astype(float) / 255.0
+    r, g, b = channels[..., 0], channels[..., 1], channels[..., 2]
     eps = 1e-6  # Для избежания деления на ноль
 
     # Нормализация и определение доминирующего канала
     total = r + g + b + eps
-    r_norm, g_norm, b_norm = r / total, g / total, b / total
-    dominant = np.argmax([r_norm, g_norm, b_norm])
+    dominant = np.argmax(np.stack([r / total, g / total, b / total], axis=-1), axis=-1)
 
     # Расчет длины волны с учетом цветового вклада
-    if dominant == 0:  # Красный доминирует
-        ratio = (r - max(g, b)) / (r + eps)
-        wavelength = 630 + 70 * ratio  # 630-700 нм
-    elif dominant == 1:  # Зеленый доминирует
-        ratio = (g - max(r, b)) / (g + eps)
-        wavelength = 520 + 50 * ratio  # 520-570 нм
-    else:  # Синий доминирует
-        ratio = (b - max(r, g)) / (b + eps)
-        wavelength = 450 + 40 * ratio  # 450-490 нм
+    wavelength = np.select(
+        [dominant == 0, dominant == 1],
+        [630 + 70 * ((r - np.maximum(g, b)) / (r + eps)),  # Красный: 630-700 нм
+         520 + 50 * ((g - np.maximum(r, b)) / (g + eps))],  # Зеленый: 520-570 нм
+        450 + 40 * ((b - np.maximum(r, g)) / (b + eps))  # Синий: 450-490 нм
+    )
 
     # Ограничение физических пределов
-    return np.clip(wavelength, 380, 750)
+    return np.clip(wavelength, 380, 750)[()]
+
+
+def build_wavelength_lut(bits=6):
+    """
+    Таблица длин волн для квантованных RGB (bits бит на канал).
+    Значение ячейки считается по середине интервала квантования; при bits=8
+    таблица совпадает с точным расчётом до точности float32 (2^24 значений, 64 МБ).
+    """
+    shift = 8 - bits
+    levels = (np.arange(1 << bits) << shift) + ((1 << shift) >> 1)
+    r, g, b = np.meshgrid(levels, levels, levels, indexing='ij')
+    return rgb_to_wavelength(np.stack([r, g, b], axis=-1)).astype(np.float32)
+
+
+def wavelength_map(img_rgb, lut=None):
+    """Карта длин волн для каждого пикселя изображения RGB (H, W, 3)"""
+    if lut is None:
+        return rgb_to_wavelength(img_rgb)
+
+    shift = 8 - int(np.log2(lut.shape[0]))
+    quantized = img_rgb >> shift
+    return lut[quantized[..., 0], quantized[..., 1], quantized[..., 2]]
+
+
+def stripe_histograms(wavelengths, stripe_width=None, bins=74, value_range=(380, 750)):
+    """
+    Гистограммы длин волн по полоскам кеограммы.
+    Возвращает массив (число полосок, bins) и границы интервалов.
+    """
+    stripe_width = stripe_width or STRIPE_WIDTH
+    height, width = wavelengths.shape
+    edges = np.linspace(value_range[0], value_range[1], bins + 1)
+
+    # Номер интервала и номер полоски для каждого пикселя, затем один bincount
+    bin_index = np.clip(np.searchsorted(edges, wavelengths, side='right') - 1, 0, bins - 1)
+    stripe_index = np.broadcast_to(np.arange(width) // stripe_width, (height, width))
+    n_stripes = -(-width // stripe_width)
+
+    counts = np.bincount((stripe_index * bins + bin_index).ravel(), minlength=n_stripes * bins)
+    return counts.reshape(n_stripes, bins), edges
 
 
-def process_keogram(image_path, output_dir):
+def stripe_peaks(gray, stripe_width=None, top_k=1):
+    """
+    Поиск пиков во всех полосках кеограммы без цикла по отдельным полоскам.
+    Полоски обрабатываются блоками (STRIPE_BLOCK_PIXELS) через представление
+    (полоски, H, ширина полоски) без копирования изображения - в том числе
+    полутоновой плоскости хранилища, записанной по столбцам. Возвращает словарь массивов:
+    y, x - координаты пика (первого максимума, как np.argmax по полоске),
+    peak, mean - временные ряды пиковой и средней яркости,
+    top_y, top_x, top_values - top_k самых ярких пикселей каждой полоски.
+    """
+    stripe_width = stripe_width or STRIPE_WIDTH
+    height, width = gray.shape
+    n_stripes = -(-width // stripe_width)
+    starts = np.arange(n_stripes) * stripe_width
+    real_widths = np.minimum(stripe_width, width - starts)
+    top_k = max(1, min(top_k, height * int(real_widths.min())))
+
+    result = {
+        'y': np.empty(n_stripes, dtype=np.int64),
+        'x': np.empty(n_stripes, dtype=np.int64),
+        'peak': np.empty(n_stripes, dtype=gray.dtype),
+        'mean': np.empty(n_stripes, dtype=np.float64),
+        'top_y': np.empty((n_stripes, top_k), dtype=np.int64),
+        'top_x': np.empty((n_stripes, top_k), dtype=np.int64),
+        'top_values': np.empty((n_stripes, top_k), dtype=gray.dtype),
+    }
+
+    # Блоки полных полосок и отдельно - неполная последняя полоска
+    full = width // stripe_width
+    block = max(1, STRIPE_BLOCK_PIXELS // (height * stripe_width))
+    spans = [(first, min(first + block, full), stripe_width) for first in range(0, full, block)]
+    if full < n_stripes:
+        spans.append((full, n_stripes, width - full * stripe_width))
+
+    for first, last, span_width in spans:
+        count = last - first
+        x_start = first * stripe_width
+        stripes = gray[:, x_start:x_start + count * span_width].reshape(height, count, span_width)
+        stripes = stripes.transpose(1, 0, 2)
+
+        # Первый максимум в порядке строк полоски - как np.argmax
+        peak = stripes.max(axis=(1, 2))
+        flat_peak = (stripes == peak[:, None, None]).reshape(count, -1).argmax(axis=1)
+        result['y'][first:last] = flat_peak // span_width
+        result['x'][first:last] = starts[first:last] + flat_peak % span_width
+        result['peak'][first:last] = peak
+        result['mean'][first:last] = stripes.sum(axis=(1, 2), dtype=np.int64) / (height * span_width)
+
+        # top_k ярких пикселей в порядке убывания яркости (при top_k=1 - сам пик)
+        if top_k == 1:
+            top_y, top_x, top_values = (flat_peak // span_width)[:, None], (flat_peak % span_width)[:, None], \
+                peak[:, None]
+        else:
+            top_y, top_x, top_values = _top_pixels(stripes.reshape(count, -1), span_width, top_k)
+        result['top_y'][first:last] = top_y
+        result['top_x'][first:last] = starts[first:last, None] + top_x
+        result['top_values'][first:last] = top_values
+
+    return result
+
+
+def _top_pixels(stripes, stripe_width, top_k):
+    """top_k максимумов каждой строки (полоски) и их координаты внутри полоски"""
+    top = np.argpartition(stripes, -top_k, axis=1)[:, -top_k:]
+    top_values = np.take_along_axis(stripes, top, axis=1)
+    order = np.argsort(-top_values.astype(np.int64), axis=1, kind='stable')
+    top = np.take_along_axis(top, order, axis=1)
+    return top // stripe_width, top % stripe_width, np.take_along_axis(top_values, order, axis=1)
+
+
+def process_keogram(image_path, output_dir, config=None):
     """Обработка кеограммы с поиском пиковых длин волн."""
-    img = cv2.imread(image_path)
+    config = config or default_config()
+    if is_store(image_path):
+        # Хранилище кеограммы: полутоновая плоскость читается блоками полосок без копии,
+        # из цветной плоскости - только пиковые пиксели
+        store = KeogramStore(image_path)
+        img, gray = store.pixels, store.gray
+        plot_name = f"{store.path.stem}_plot.png"
+    else:
+        img = cv2.imread(image_path)
+        gray = None if img is None else cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        plot_name = os.path.basename(image_path).replace('.png', '_plot.png')
     if img is None:
         print(f"Ошибка: Не удалось загрузить {image_path}")
         return
 
-    img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    height, width = gray.shape
-    wavelengths = []
-
-    for x_start in range(0, width, STRIPE_WIDTH):
-        x_end = min(x_start + STRIPE_WIDTH, width)
-        stripe_gray = gray[:, x_start:x_end]
-
-        # Поиск координаты пикового пикселя
-        y_max, x_local = np.unravel_index(
-            np.argmax(stripe_gray), stripe_gray.shape
-        )
-        x_global = x_start + x_local
-
-        # Получение RGB пикового пикселя
-        peak_rgb = img_rgb[y_max, x_global]
-        wavelength = rgb_to_wavelength(peak_rgb)
-        wavelengths.append(wavelength)
+    # Пиковые пиксели всех полосок за один проход и их длины волн
+    peaks = stripe_peaks(gray, config.stripe_width)
+    wavelengths = rgb_to_wavelength(np.asarray(img[peaks['y'], peaks['x']])[:, ::-1])
 
     # Построение графика
     plt.figure(figsize=(12, 6))
@@ -75,10 +182,13 @@ def process_keogram(image_path, output_dir):
     plt.grid(True)
 
     os.makedirs(output_dir, exist_ok=True)
-    output_path = os.path.join(output_dir, os.path.basename(image_path).replace('.png', '_plot.png'))
+    output_path = os.path.join(output_dir, plot_name)
     plt.savefig(output_path, dpi=150, bbox_inches='tight')
     plt.close()
 
+    peaks['wavelength'] = wavelengths
+    return peaks
+
 
 def graphscalc():
     """Обработка всех изображений в папке."""
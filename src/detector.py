@@ -1,87 +1,649 @@
+import csv
 import cv2
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from datetime import datetime
 
+from src.Job_config import default_config
+from src.Keogram_store import KeogramStore, is_store
+
 # Настройки анализа
 PERCENTILE = 99  # Уровень перцентиля (можно менять)
 MIN_AREA = 20  # Минимальный размер области
 
+# Папки по умолчанию
+INPUT_DIR = Path("E:\CMU\Code\Greyscale\Grayscale_Output")
+OUTPUT_DIR = Path("E:\CMU\Code\Samples_detected\Bright98_Output")
 
-def find_bright_regions(gray_img, percentile):
-    """Находит контуры ярких областей выше указанного перцентиля"""
-    non_black_mask = gray_img > 0
+# Текстовый отчёт Brightness_data.txt поверх табличных результатов
+TEXT_REPORT = True
 
-    if np.any(non_black_mask):
-        threshold = np.percentile(gray_img[non_black_mask], percentile)
-    else:
-        return [], 0, np.zeros_like(gray_img)
+# Изображения шире обрабатываются окнами по столбцам такой ширины (0 - всегда целиком)
+DETECT_CHUNK_WIDTH = 8192
+
+# Предельная ширина изображения с контурами для таких кеограмм: шире - уменьшается
+# в целое число раз (память не растёт с шириной кеограммы)
+DETECT_MARKED_WIDTH = 16384
+
+# Сопровождение областей между соседними кадрами (или порциями столбцов кеограммы):
+# допустимый зазор между рамками, пропуск кадров без области, размер ячейки сетки поиска
+# и число ячеек, больше которого рамка не кладётся в сетку, а сравнивается со всеми напрямую
+TRACK_DISTANCE = 10  # None - без сопровождения
+TRACK_MAX_GAP = 1
+TRACK_CELL_SIZE = 64
+TRACK_MAX_CELLS = 16
+
+# Столбцы табличных результатов: одна строка на область
+RESULT_COLUMNS = ('image', 'threshold', 'label', 'track', 'area', 'pixels', 'perimeter',
+                  'x', 'y', 'w', 'h', 'cx', 'cy', 'peak', 'mean', 'points')
+
+# Итог по трекам и временной ряд каждого трека
+TRACK_COLUMNS = ('track', 'first_image', 'last_image', 'first_frame', 'last_frame',
+                 'lifetime', 'detections', 'peak', 'mean')
+SERIES_COLUMNS = ('track', 'frame', 'image', 'cx', 'cy', 'pixels', 'peak', 'mean')
+
+
+def brightness_histogram(gray_img):
+    """Гистограмма яркостей uint8 без учёта чёрных пикселей (бин 0 обнулён)"""
+    hist = np.bincount(gray_img.ravel(), minlength=256)
+    hist[0] = 0
+    return hist
+
+
+def histogram_percentile(hist, percentile):
+    """
+    Перцентиль (или массив перцентилей) по гистограмме яркостей.
+    Совпадает с np.percentile (линейная интерполяция) по тем же пикселям,
+    но не требует сортировки - по одной гистограмме можно перебирать пороги.
+    """
+    cumulative = np.cumsum(hist)
+    n = cumulative[-1]
+
+    # Индексы и интерполяция - как в np.percentile(method='linear')
+    virtual = (n - 1) * (np.asarray(percentile, dtype=np.float64) / 100)
+    lower = np.floor(virtual)
+    gamma = virtual - lower
+    lower = lower.astype(np.int64)
+    upper = np.minimum(lower + 1, n - 1)
 
+    # k-й по порядку пиксель попадает в первый бин, где накопленная сумма больше k
+    lower_value = np.searchsorted(cumulative, lower, side='right').astype(np.float64)
+    upper_value = np.searchsorted(cumulative, upper, side='right').astype(np.float64)
+    diff = upper_value - lower_value
+
+    return np.where(gamma >= 0.5,
+                    upper_value - diff * (1 - gamma),
+                    lower_value + diff * gamma)[()]
+
+
+def bright_mask(gray_img, percentile, hist=None):
+    """
+    Порог по перцентилю ненулевых пикселей и бинарная маска ярких областей.
+    hist - готовая гистограмма (например, накопленная по всей кеограмме),
+    по которой считается порог вместо гистограммы самого изображения.
+    """
+    if hist is None:
+        hist = brightness_histogram(gray_img)
+    if not hist.any():
+        return 0, np.zeros_like(gray_img)
+
+    threshold = histogram_percentile(hist, percentile)
     _, binary_mask = cv2.threshold(gray_img, threshold, 255, cv2.THRESH_BINARY)
-    contours, _ = cv2.findContours(binary_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    return threshold, binary_mask
+
+
+def region_stats(gray_img, binary_mask):
+    """
+    Статистика всех связных областей маски за один вызов connectedComponentsWithStats.
+    Возвращает словарь массивов (по элементу на область, в порядке меток) и карту меток.
+    first - номер первого пикселя области при построчном обходе (y * ширина + x),
+    brightness - сумма яркостей.
+    """
+    count, labels, stats, centroids = cv2.connectedComponentsWithStats(
+        binary_mask, connectivity=8, ltype=cv2.CV_32S)
+
+    # Пиковая и средняя яркость по пикселям каждой метки
+    flat_labels = labels.ravel()
+    foreground = np.flatnonzero(flat_labels)
+    region_labels = flat_labels[foreground]
+    values = gray_img.ravel()[foreground]
+
+    peak = np.zeros(count, dtype=gray_img.dtype)
+    np.maximum.at(peak, region_labels, values)
+    pixels = stats[:, cv2.CC_STAT_AREA]
+    brightness = np.bincount(region_labels, weights=values, minlength=count)
+
+    # Пиксели переднего плана идут в порядке обхода - первое вхождение метки и есть её начало
+    _, first = np.unique(region_labels, return_index=True)
+
+    # Метка 0 - фон
+    regions = {
+        'label': np.arange(1, count),
+        'pixels': pixels[1:],
+        'x': stats[1:, cv2.CC_STAT_LEFT],
+        'y': stats[1:, cv2.CC_STAT_TOP],
+        'w': stats[1:, cv2.CC_STAT_WIDTH],
+        'h': stats[1:, cv2.CC_STAT_HEIGHT],
+        'cx': centroids[1:, 0],
+        'cy': centroids[1:, 1],
+        'peak': peak[1:],
+        'mean': brightness[1:] / np.maximum(pixels[1:], 1),
+        'first': foreground[first],
+        'brightness': brightness[1:],
+    }
+    return regions, labels
+
+
+def detect_regions(gray_img, percentile, hist=None, min_area=None):
+    """
+    Яркие области выше перцентиля: словарь массивов статистики и контуры.
+    Контуры извлекаются только для областей, которые могут пройти min_area
+    (по умолчанию MIN_AREA).
+    """
+    min_area = MIN_AREA if min_area is None else min_area
+    threshold, binary_mask = bright_mask(gray_img, percentile, hist)
+    regions, labels = region_stats(gray_img, binary_mask)
+
+    outlines = {}
+    for i in contour_candidates(regions, min_area):
+        outlines[i] = region_contour(labels, regions, i)
 
-    valid_contours = []
-    for cnt in contours:
-        if cv2.contourArea(cnt) < MIN_AREA or np.max(
-                gray_img[cv2.boundingRect(cnt)[1]:cv2.boundingRect(cnt)[1] + cv2.boundingRect(cnt)[3],
-                cv2.boundingRect(cnt)[0]:cv2.boundingRect(cnt)[0] + cv2.boundingRect(cnt)[2]]) == 0:
+    regions, contours = finish_regions(regions, outlines, min_area)
+    return regions, contours, threshold, binary_mask
+
+
+def contour_candidates(regions, min_area):
+    """Области, которые могут пройти min_area: площадь контура не больше (w - 1) * (h - 1)"""
+    return np.flatnonzero(((regions['w'] - 1) * (regions['h'] - 1) >= min_area) & (regions['peak'] > 0))
+
+
+def region_contour(labels, regions, i, label=None):
+    """Внешний контур области i по карте меток: (контур, площадь, периметр)"""
+    x, y, w, h = regions['x'][i], regions['y'][i], regions['w'][i], regions['h'][i]
+    label = regions['label'][i] if label is None else label
+    region_mask = (labels[y:y + h, x:x + w] == label).astype(np.uint8)
+    found, _ = cv2.findContours(region_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE,
+                                offset=(int(x), int(y)))
+    cnt = found[0]
+    return cnt, cv2.contourArea(cnt), cv2.arcLength(cnt, True)
+
+
+def finish_regions(regions, outlines, min_area):
+    """
+    Итоговые области и их контуры: порядок и номера - по первому пикселю при
+    построчном обходе (не зависят от порядка меток OpenCV и от деления на окна),
+    только области с контуром не меньше min_area. outlines - контуры кандидатов
+    по индексу области.
+    """
+    order = np.argsort(regions['first'], kind='stable')
+    keep = [i for i in order if i in outlines and outlines[i][1] >= min_area]
+    labels = np.empty(len(order), dtype=np.int64)
+    labels[order] = np.arange(1, len(order) + 1)
+
+    result = {key: column[keep] for key, column in regions.items() if key not in ('first', 'brightness')}
+    result['label'] = labels[keep]
+    result['area'] = np.asarray([outlines[i][1] for i in keep], dtype=np.float64)
+    result['perimeter'] = np.asarray([outlines[i][2] for i in keep], dtype=np.float64)
+    return result, [outlines[i][0] for i in keep]
+
+
+def chunk_regions(gray_img, threshold, bounds, index, min_area):
+    """
+    Области одного окна столбцов bounds[index] в координатах всего изображения.
+    Контуры строятся сразу только для областей, не касающихся внутренних границ
+    окна: такие области заведомо целые. Возвращает также метки крайних столбцов
+    для склейки с соседними окнами.
+    """
+    width = gray_img.shape[1]
+    x_start, x_end = bounds[index]
+    chunk = np.ascontiguousarray(gray_img[:, x_start:x_end])
+    _, mask = cv2.threshold(chunk, threshold, 255, cv2.THRESH_BINARY)
+    regions, labels = region_stats(chunk, mask)
+
+    left = labels[:, 0].copy() if index > 0 else np.zeros(0, dtype=labels.dtype)
+    right = labels[:, -1].copy() if index < len(bounds) - 1 else np.zeros(0, dtype=labels.dtype)
+    on_seam = np.zeros(len(regions['label']) + 1, dtype=bool)
+    on_seam[left] = on_seam[right] = True
+    on_seam[0] = False
+
+    outlines = {}
+    for i in contour_candidates(regions, min_area):
+        if not on_seam[regions['label'][i]]:
+            cnt, area, perimeter = region_contour(labels, regions, i)
+            outlines[i] = cnt + np.array([x_start, 0], dtype=cnt.dtype), area, perimeter
+
+    # Точные суммы координат (центр OpenCV = сумма / площадь) для объединения частей
+    regions['sum_x'] = np.rint(regions['cx'] * regions['pixels']) + x_start * regions['pixels']
+    regions['sum_y'] = np.rint(regions['cy'] * regions['pixels'])
+    first_y, first_x = np.divmod(regions['first'], x_end - x_start)
+    regions['first'] = first_y * width + first_x + x_start
+    regions['x'] = regions['x'] + x_start
+    return regions, outlines, left, right
+
+
+def seam_pairs(right, left):
+    """Пары меток, соединённых через границу окон (8-связность: соседние строки тоже)"""
+    pairs = []
+    for dy in (-1, 0, 1):
+        a = right[max(0, -dy):len(right) - max(0, dy)]
+        b = left[max(0, dy):len(left) - max(0, -dy)]
+        touch = (a > 0) & (b > 0)
+        pairs.append(np.stack([a[touch], b[touch]], axis=1))
+    return np.unique(np.concatenate(pairs), axis=0)
+
+
+def detect_regions_chunked(gray_img, percentile, hist=None, min_area=None, chunk_width=None, workers=None):
+    """
+    То же, что detect_regions, но по окнам столбцов шириной chunk_width
+    (по умолчанию DETECT_CHUNK_WIDTH), которые обрабатываются параллельно.
+    Изображение (например, np.memmap хранилища) целиком в память не копируется.
+    Порог считается по общей гистограмме всех окон, области на границах окон
+    склеиваются, поэтому результат совпадает с обработкой целиком.
+    Бинарная маска всего изображения не строится (возвращается None).
+    """
+    min_area = MIN_AREA if min_area is None else min_area
+    chunk_width = chunk_width or DETECT_CHUNK_WIDTH
+    height, width = gray_img.shape
+    bounds = [(x, min(width, x + chunk_width)) for x in range(0, width, chunk_width)]
+
+    with ThreadPoolExecutor(max_workers=max(1, workers or 1)) as executor:
+        if hist is None:
+            hist = sum(executor.map(lambda b: brightness_histogram(gray_img[:, b[0]:b[1]]), bounds))
+        # Пустая гистограмма - как и при обработке целиком, порог 0 и пустая маска
+        threshold = histogram_percentile(hist, percentile) if hist.any() else 0
+        mask_threshold = threshold if hist.any() else 255
+        parts = list(executor.map(lambda i: chunk_regions(gray_img, mask_threshold, bounds, i, min_area),
+                                  range(len(bounds))))
+
+    # Сквозная нумерация частей и их склейка через границы окон (система непересекающихся множеств)
+    offsets = np.cumsum([0] + [len(part[0]['label']) for part in parts])
+    parent = np.arange(offsets[-1])
+
+    def find(node):
+        while parent[node] != node:
+            parent[node] = parent[parent[node]]
+            node = parent[node]
+        return node
+
+    for k in range(len(parts) - 1):
+        for a, b in seam_pairs(parts[k][3], parts[k + 1][2]):
+            root_a, root_b = find(offsets[k] + a - 1), find(offsets[k + 1] + b - 1)
+            if root_a != root_b:
+                parent[max(root_a, root_b)] = min(root_a, root_b)
+    while True:
+        jumped = parent[parent]
+        if np.array_equal(jumped, parent):
+            break
+        parent = jumped
+
+    keys = ('pixels', 'x', 'y', 'w', 'h', 'peak', 'first', 'brightness', 'sum_x', 'sum_y')
+    part_regions = {key: np.concatenate([part[0][key] for part in parts]) for key in keys}
+    roots, group = np.unique(parent, return_inverse=True)
+    count = len(roots)
+
+    def merged(values, ufunc, initial):
+        result = np.full(count, initial, dtype=values.dtype)
+        ufunc.at(result, group, values)
+        return result
+
+    x_min = merged(part_regions['x'], np.minimum, np.iinfo(np.int32).max)
+    y_min = merged(part_regions['y'], np.minimum, np.iinfo(np.int32).max)
+    x_max = merged(part_regions['x'] + part_regions['w'], np.maximum, 0)
+    y_max = merged(part_regions['y'] + part_regions['h'], np.maximum, 0)
+    pixels = np.bincount(group, weights=part_regions['pixels'], minlength=count)
+    brightness = np.bincount(group, weights=part_regions['brightness'], minlength=count)
+    regions = {
+        'label': np.arange(1, count + 1),
+        'pixels': pixels.astype(part_regions['pixels'].dtype),
+        'x': x_min,
+        'y': y_min,
+        'w': x_max - x_min,
+        'h': y_max - y_min,
+        'cx': np.bincount(group, weights=part_regions['sum_x'], minlength=count) / pixels,
+        'cy': np.bincount(group, weights=part_regions['sum_y'], minlength=count) / pixels,
+        'peak': merged(part_regions['peak'], np.maximum, 0),
+        'mean': brightness / np.maximum(pixels, 1),
+        'first': merged(part_regions['first'], np.minimum, np.iinfo(np.int64).max),
+        'brightness': brightness,
+    }
+
+    # Контуры целых областей окон переносятся, склеенные области размечаются заново по своей рамке
+    outlines = {}
+    for k, (_, part_outlines, _, _) in enumerate(parts):
+        for i, outline in part_outlines.items():
+            outlines[group[offsets[k] + i]] = outline
+    for i in contour_candidates(regions, min_area):
+        if i in outlines:
             continue
-        valid_contours.append(cnt)
+        x, y, w, h = regions['x'][i], regions['y'][i], regions['w'][i], regions['h'][i]
+        _, crop_mask = cv2.threshold(np.ascontiguousarray(gray_img[y:y + h, x:x + w]),
+                                     mask_threshold, 255, cv2.THRESH_BINARY)
+        _, crop_labels = cv2.connectedComponents(crop_mask, connectivity=8, ltype=cv2.CV_32S)
+        first_y, first_x = divmod(int(regions['first'][i]), width)
+        crop = {'x': [0], 'y': [0], 'w': [w], 'h': [h]}
+        cnt, area, perimeter = region_contour(crop_labels, crop, 0, crop_labels[first_y - y, first_x - x])
+        outlines[i] = cnt + np.array([x, y], dtype=cnt.dtype), area, perimeter
 
-    return valid_contours, threshold, binary_mask
+    return (*finish_regions(regions, outlines, min_area), threshold, None)
 
 
-def process_image(img_path, output_dir, log_file):
-    gray = cv2.imread(str(img_path), cv2.IMREAD_GRAYSCALE)
-    if gray is None:
-        log_file.write(f"ОШИБКА: Не удалось загрузить {img_path.name}\n")
-        return
+def find_bright_regions(gray_img, percentile):
+    """Находит контуры ярких областей выше указанного перцентиля"""
+    _, contours, threshold, binary_mask = detect_regions(gray_img, percentile)
+    return contours, threshold, binary_mask
+
+
+class RegionTracker:
+    """
+    Пошаговое сопровождение ярких областей: области нового кадра связываются
+    с треками предыдущих кадров, и каждая область получает постоянный номер трека.
+    Кандидаты ищутся через равномерную сетку по рамкам активных треков; сетка
+    хранится между кадрами и обновляется только для изменившихся и завершённых
+    треков. Большие рамки (больше TRACK_MAX_CELLS ячеек) в сетку не кладутся:
+    большие треки проверяются для каждой области, а большая область - со всеми
+    треками, поэтому стоимость кадра почти линейна по числу областей. Связываются области, рамки
+    которых разделяет не больше distance пикселей по каждой оси; из нескольких
+    кандидатов выбираются пары с ближайшими центрами (каждый трек - не больше
+    одной области за кадр). Трек без областей дольше max_gap кадров завершается.
+    """
+
+    def __init__(self, distance=None, max_gap=None, cell_size=None):
+        self.distance = TRACK_DISTANCE if distance is None else distance
+        self.max_gap = TRACK_MAX_GAP if max_gap is None else max_gap
+        self.cell_size = max(1, int(cell_size or TRACK_CELL_SIZE))
+        self.frame = -1
+        self.next_track = 1
+        self.active = {}  # трек -> (последний кадр, x0, y0, x1, y1, cx, cy)
+        self.grid = {}  # ячейка -> треки, рамки которых её покрывают
+        self.track_cells = {}  # трек -> его ячейки сетки (None для большой рамки)
+        self.large = set()  # треки с большими рамками вне сетки
+        self.summary = {}  # трек -> итог (см. TRACK_COLUMNS)
+        self.series = {key: [] for key in SERIES_COLUMNS}
+
+    def cell_ranges(self, x0, y0, x1, y1):
+        """Номера столбцов и строк сетки, которые покрывает рамка [x0, x1) x [y0, y1), расширенная на distance"""
+        size, pad = self.cell_size, self.distance
+        return (range(int((x0 - pad) // size), int((x1 + pad) // size) + 1),
+                range(int((y0 - pad) // size), int((y1 + pad) // size) + 1))
+
+    def cells(self, x0, y0, x1, y1):
+        """Ячейки сетки, которые покрывает рамка, или None, если их больше TRACK_MAX_CELLS"""
+        columns, rows = self.cell_ranges(x0, y0, x1, y1)
+        if len(columns) * len(rows) > TRACK_MAX_CELLS:
+            return None
+        return [(cx, cy) for cx in columns for cy in rows]
+
+    def place(self, track, state):
+        """Новое состояние трека и его ячейки в сетке (прежние ячейки освобождаются)"""
+        self.remove(track)
+        self.active[track] = state
+        cells = self.cells(*state[1:5])
+        self.track_cells[track] = cells
+        if cells is None:
+            self.large.add(track)
+            return
+        for cell in cells:
+            self.grid.setdefault(cell, set()).add(track)
+
+    def remove(self, track):
+        """Удаление трека из сетки и из активных"""
+        self.active.pop(track, None)
+        self.large.discard(track)
+        for cell in self.track_cells.pop(track, None) or ():
+            bucket = self.grid[cell]
+            bucket.discard(track)
+            if not bucket:
+                del self.grid[cell]
+
+    def update(self, regions, name=''):
+        """Номера треков для областей нового кадра (массив по порядку областей)"""
+        self.frame += 1
+        for track in [track for track, state in self.active.items()
+                      if self.frame - state[0] > self.max_gap + 1]:
+            self.remove(track)
+
+        count = len(regions['label'])
+        x0, y0 = regions['x'], regions['y']
+        x1, y1 = x0 + regions['w'], y0 + regions['h']
+        pairs = []
+        for i in range(count):
+            cells = self.cells(x0[i], y0[i], x1[i], y1[i])
+            if cells is None:
+                candidates = self.active.keys()
+            else:
+                candidates = self.large.union(*(self.grid.get(cell, ()) for cell in cells))
+            for track in candidates:
+                _, tx0, ty0, tx1, ty1, tcx, tcy = self.active[track]
+                gap_x = max(tx0 - x1[i], x0[i] - tx1, 0)
+                gap_y = max(ty0 - y1[i], y0[i] - ty1, 0)
+                if gap_x <= self.distance and gap_y <= self.distance:
+                    pairs.append(((regions['cx'][i] - tcx) ** 2 + (regions['cy'][i] - tcy) ** 2, track, i))
+
+        tracks = np.zeros(count, dtype=np.int64)
+        used = set()
+        for _, track, i in sorted(pairs):
+            if not tracks[i] and track not in used:
+                tracks[i] = track
+                used.add(track)
+
+        for i in range(count):
+            if not tracks[i]:
+                tracks[i] = self.next_track
+                self.next_track += 1
+            self.record(int(tracks[i]), regions, i, name)
+            self.place(int(tracks[i]), (self.frame, x0[i], y0[i], x1[i], y1[i],
+                                        regions['cx'][i], regions['cy'][i]))
+
+        series = {'track': tracks, 'frame': np.full(count, self.frame), 'image': np.full(count, name)}
+        for key in SERIES_COLUMNS[3:]:
+            series[key] = np.asarray(regions[key])
+        for key in SERIES_COLUMNS:
+            self.series[key].append(series[key])
+        return tracks
+
+    def record(self, track, regions, i, name):
+        pixels, peak = int(regions['pixels'][i]), regions['peak'][i].item()
+        brightness = regions['mean'][i] * pixels
+        summary = self.summary.get(track)
+        if summary is None:
+            self.summary[track] = {'first_image': name, 'last_image': name, 'first_frame': self.frame,
+                                   'last_frame': self.frame, 'detections': 1, 'peak': peak,
+                                   'pixels': pixels, 'brightness': brightness}
+        else:
+            summary.update(last_image=name, last_frame=self.frame, detections=summary['detections'] + 1,
+                           peak=max(summary['peak'], peak), pixels=summary['pixels'] + pixels,
+                           brightness=summary['brightness'] + brightness)
+
+    def tracks(self):
+        """Итог по трекам: словарь столбцов TRACK_COLUMNS (время жизни - в кадрах)"""
+        ids = sorted(self.summary)
+        rows = [self.summary[track] for track in ids]
+        columns = {key: np.array([row[key] for row in rows], dtype=np.int64)
+                   for key in ('first_frame', 'last_frame', 'detections', 'peak')}
+        columns.update({key: np.array([row[key] for row in rows], dtype=str)
+                        for key in ('first_image', 'last_image')})
+        columns['track'] = np.array(ids, dtype=np.int64)
+        columns['lifetime'] = columns['last_frame'] - columns['first_frame'] + 1
+        columns['mean'] = np.array([row['brightness'] / max(row['pixels'], 1) for row in rows], dtype=np.float64)
+        return {key: columns[key] for key in TRACK_COLUMNS}
+
+    def track_series(self, track=None):
+        """Временные ряды (кадр, центр, площадь, яркость) одного трека или всех, по трекам и кадрам"""
+        series = {key: np.concatenate(parts) if parts else np.empty(0)
+                  for key, parts in self.series.items()}
+        order = np.lexsort((series['frame'], series['track']))
+        if track is not None:
+            order = order[series['track'][order] == track]
+        return {key: column[order] for key, column in series.items()}
+
+
+def region_tracker(config):
+    """Сопровождение областей по настройкам задания (None, если отключено)"""
+    if config.track_distance is None:
+        return None
+    return RegionTracker(config.track_distance, config.track_max_gap)
+
+
+class DetectionResults:
+    """
+    Табличные результаты детекции: строки пишутся в CSV пачкой на изображение,
+    а при закрытии все столбцы сохраняются в компактный .npz.
+    Текстовый отчёт - необязательное представление тех же данных.
+    С tracker области получают номера треков, а при закрытии сохраняются
+    итог по трекам (Brightness_tracks.csv) и их временные ряды (Brightness_tracks.npz).
+    """
+
+    def __init__(self, output_dir, text_report=None, percentile=None, tracker=None):
+        self.output_dir = Path(output_dir)
+        self.columns = {key: [] for key in RESULT_COLUMNS}
+        self.tracker = tracker
+
+        self.csv_file = open(self.output_dir / "Brightness_data.csv", "w", newline="", encoding="utf-8")
+        self.csv_writer = csv.writer(self.csv_file)
+        self.csv_writer.writerow(RESULT_COLUMNS)
+
+        self.log_file = None
+        if TEXT_REPORT if text_report is None else text_report:
+            self.log_file = open(self.output_dir / "Brightness_data.txt", "w", encoding="utf-8")
+            percentile = PERCENTILE if percentile is None else percentile
+            self.log_file.write(f"Отчет: Точные контуры ({percentile} перцентиль)\n")
+            self.log_file.write(f"Дата: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n")
 
-    contours, threshold, mask = find_bright_regions(gray, PERCENTILE)
-    marked_img = cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR)
+    def __enter__(self):
+        return self
 
-    # Рисуем точные контуры вместо прямоугольников
-    cv2.drawContours(marked_img, contours, -1, (0, 255, 0), 1)
+    def __exit__(self, *exc):
+        self.close()
 
-    # Запись информации о контурах
+    def add(self, name, threshold, regions, saved_name=None):
+        """Добавление всех областей одного изображения"""
+        count = len(regions['label'])
+        regions = dict(regions)
+        regions['track'] = (self.tracker.update(regions, name) if self.tracker
+                            else np.zeros(count, dtype=np.int64))
+        batch = dict(regions)
+        batch['image'] = np.full(count, name)
+        batch['threshold'] = np.full(count, float(threshold))
+
+        for key in RESULT_COLUMNS:
+            self.columns[key].append(np.asarray(batch[key]))
+        self.csv_writer.writerows(zip(*(batch[key].tolist() for key in RESULT_COLUMNS)))
+
+        if self.log_file:
+            render_text_entry(self.log_file, name, threshold, regions, saved_name)
+
+    def error(self, name):
+        if self.log_file:
+            self.log_file.write(f"ОШИБКА: Не удалось загрузить {name}\n")
+
+    def close(self):
+        self.csv_file.close()
+
+        columns = {key: np.concatenate(parts) if parts else np.empty(0)
+                   for key, parts in self.columns.items()}
+        np.savez(self.output_dir / "Brightness_data.npz", **columns)
+
+        if self.tracker:
+            tracks = self.tracker.tracks()
+            with open(self.output_dir / "Brightness_tracks.csv", "w", newline="", encoding="utf-8") as f:
+                writer = csv.writer(f)
+                writer.writerow(TRACK_COLUMNS)
+                writer.writerows(zip(*(tracks[key].tolist() for key in TRACK_COLUMNS)))
+            series = {f"series_{key}": column for key, column in self.tracker.track_series().items()}
+            np.savez(self.output_dir / "Brightness_tracks.npz", **tracks, **series)
+
+        if self.log_file:
+            self.log_file.write("\n" + "=" * 60 + "\n")
+            self.log_file.write("Анализ завершен\n")
+            self.log_file.close()
+
+
+def render_text_entry(log_file, name, threshold, regions, saved_name=None):
+    """Текстовое описание областей одного изображения"""
     log_file.write("\n" + "=" * 60 + "\n")
-    log_file.write(f"Изображение: {img_path.name}\n")
-    log_file.write(f"Порог: {threshold:.1f} | Областей: {len(contours)}\n")
+    log_file.write(f"Изображение: {name}\n")
+    log_file.write(f"Порог: {threshold:.1f} | Областей: {len(regions['label'])}\n")
 
-    for i, cnt in enumerate(contours, 1):
-        area = cv2.contourArea(cnt)
-        perimeter = cv2.arcLength(cnt, True)
-        x, y, w, h = cv2.boundingRect(cnt)
+    for i in range(len(regions['label'])):
+        x, y, w, h = (regions[key][i] for key in ('x', 'y', 'w', 'h'))
 
         log_file.write("\n" + "-" * 50 + "\n")
-        log_file.write(f"Область {i}:\n")
-        log_file.write(f"Площадь: {area} px²\n")
-        log_file.write(f"Периметр: {perimeter:.1f} px\n")
+        log_file.write(f"Область {i + 1}:\n")
+        if regions.get('track') is not None and regions['track'][i]:
+            log_file.write(f"Трек: {regions['track'][i]}\n")
+        log_file.write(f"Площадь: {regions['area'][i]} px²\n")
+        log_file.write(f"Периметр: {regions['perimeter'][i]:.1f} px\n")
         log_file.write(f"Bounding Box: [{x}, {y}, {w}, {h}]\n")
-        log_file.write(f"Координаты контура: {len(cnt)} точек\n")
+        log_file.write(f"Координаты контура: {regions['points'][i]} точек\n")
 
-    output_path = output_dir / f"contour_{img_path.name}"
-    cv2.imwrite(str(output_path), marked_img)
-    log_file.write(f"\nСохранено: {output_path.name}\n")
+    if saved_name:
+        log_file.write(f"\nСохранено: {saved_name}\n")
 
 
-def detect():
-    input_dir = Path("E:\CMU\Code\Greyscale\Grayscale_Output")
-    output_dir = Path("E:\CMU\Code\Samples_detected\Bright98_Output")
-    output_dir.mkdir(exist_ok=True)
+def load_results(path):
+    """Загрузка табличных результатов (.npz) в словарь столбцов"""
+    with np.load(path, allow_pickle=False) as data:
+        return {key: data[key] for key in data.files}
 
-    log_path = output_dir / "Brightness_data.txt"
 
-    with open(log_path, "w", encoding="utf-8") as log_file:
-        log_file.write(f"Отчет: Точные контуры ({PERCENTILE} перцентиль)\n")
-        log_file.write(f"Дата: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n")
+def process_image(img_path, output_dir, results, config=None):
+    gray = cv2.imread(str(img_path), cv2.IMREAD_GRAYSCALE)
+    if gray is None:
+        results.error(img_path.name)
+        return
 
-        for img_path in input_dir.glob('*'):
-            if img_path.suffix.lower() in {'.jpg', '.jpeg', '.png', '.bmp'}:
-                process_image(img_path, output_dir, log_file)
+    process_gray(gray, img_path.name, output_dir, results, config)
 
-        log_file.write("\n" + "=" * 60 + "\n")
-        log_file.write("Анализ завершен\n")
 
-    print(f"Результаты в: {output_dir}")
+def process_gray(gray, name, output_dir, results, config=None):
+    """Поиск ярких областей на уже загруженном полутоновом изображении"""
+    config = config or default_config()
+    scale = 1
+    if config.detect_chunk_width and gray.shape[1] > config.detect_chunk_width:
+        # Широкая кеограмма: окна столбцов параллельно, без копии и маски всего изображения
+        regions, contours, threshold, _ = detect_regions_chunked(
+            gray, config.percentile, min_area=config.min_area,
+            chunk_width=config.detect_chunk_width, workers=config.workers)
+        if config.detect_marked_width:
+            scale = max(1, -(-gray.shape[1] // config.detect_marked_width))
+    else:
+        gray = np.ascontiguousarray(gray)  # Представление хранилища (np.memmap) читается один раз
+        regions, contours, threshold, _ = detect_regions(gray, config.percentile, min_area=config.min_area)
+
+    # Рисуем точные контуры вместо прямоугольников (на уменьшенной копии - каждый scale-й пиксель)
+    marked_img = cv2.cvtColor(np.ascontiguousarray(gray[::scale, ::scale]), cv2.COLOR_GRAY2BGR)
+    cv2.drawContours(marked_img, [cnt // scale for cnt in contours] if scale > 1 else contours,
+                     -1, (0, 255, 0), 1)
+
+    output_path = output_dir / f"contour_{name}"
+    cv2.imwrite(str(output_path), marked_img)
 
+    regions['points'] = np.array([len(cnt) for cnt in contours], dtype=np.int64)
+    results.add(name, threshold, regions, output_path.name)
+
+
+def detect(input_dir=None, output_dir=None, images=None, config=None):
+    """
+    Поиск ярких областей во всех изображениях папки input_dir.
+    Если передан images (пары имя - полутоновый массив), папка не читается.
+    """
+    config = config or default_config()
+    input_dir = Path(input_dir or INPUT_DIR)
+    output_dir = Path(output_dir or config.detect_output_dir)
+    output_dir.mkdir(exist_ok=True)
+
+    with DetectionResults(output_dir, config.text_report, config.percentile, region_tracker(config)) as results:
+        if images is not None:
+            for name, gray in images:
+                process_gray(gray, name, output_dir, results, config)
+        else:
+            # По порядку имён (времени съёмки) - для сопровождения областей между кадрами
+            for img_path in sorted(input_dir.glob('*')):
+                if img_path.suffix.lower() in {'.jpg', '.jpeg', '.png', '.bmp'}:
+                    process_image(img_path, output_dir, results, config)
+                elif is_store(img_path):
+                    # Хранилище кеограммы: полутоновая плоскость без декодирования
+                    process_gray(KeogramStore(img_path).gray, f"{img_path.stem}.png", output_dir, results, config)
+
+    print(f"Результаты в: {output_dir}")